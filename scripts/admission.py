@@ -0,0 +1,152 @@
+# admission.py
+"""
+Admission control for the route pipeline: inbound load shedding and outbound rate limits.
+
+AdmissionController bounds how many route computations run at once (max_concurrent) and how
+many may wait for a slot (max_queue). A request is turned away straight away, rather than left to
+time out, when the queue is full or when the expected wait (queue position x recent computation
+time / slots) already exceeds its deadline (max_wait seconds). Waiters that are still queued at
+their deadline are dropped too. Rejections raise Overloaded with a Retry-After estimate, which
+the backend returns as a fast 503.
+
+TokenBucket limits outbound calls (Google geocoding and directions) to `rate` per second with
+bursts of up to `burst`. A caller reserves a token and sleeps until it is due; if that would take
+longer than max_wait, it gets Overloaded instead of spending quota the service does not have.
+
+Cache hits never reach either: the backend admits only result-cache misses (single-flight
+leaders), so a spike of popular requests is still served while new work is shed.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import inc, set_gauge
+
+
+class Overloaded(Exception):
+    """Work turned away to protect the service; retry_after is a hint in whole seconds."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, name, rate, burst=None):
+        """
+        :param name: Label for metrics (e.g. "geocode")
+        :param rate: Tokens per second; 0 or less disables the limit
+        :param burst: Bucket size (default: one second of tokens)
+        """
+        self.name = name
+        self.rate = rate
+        self.capacity = max(1.0, float(burst if burst is not None else rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, max_wait):
+        """Take a token; returns (seconds until it is due, None) or (None, seconds until one would be)."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None, wait
+            # Tokens may go negative: later callers queue behind this reservation
+            self._tokens -= 1
+            return wait, None
+
+    def acquire(self, max_wait):
+        """Block until a token is available, or raise Overloaded if that takes longer than max_wait seconds."""
+        if self.rate <= 0:
+            return
+        wait, retry_after = self._reserve(max_wait)
+        if wait is None:
+            inc("outbound_rate_limited_total", api=self.name)
+            raise Overloaded(f"Outbound {self.name} rate limit reached", retry_after)
+        if wait > 0:
+            inc("outbound_rate_limit_wait_seconds_total", wait, api=self.name)
+            time.sleep(wait)
+
+
+class AdmissionController:
+    def __init__(self, name, max_concurrent, max_queue, max_wait):
+        """
+        :param name: Label for metrics (e.g. "process_route")
+        :param max_concurrent: Computations allowed to run at once; 0 or less disables admission control
+        :param max_queue: Requests allowed to wait for a slot
+        :param max_wait: Seconds a request may wait before it is shed
+        """
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        # Exponentially weighted mean of recent computation times, for the wait estimate
+        self.service_time = None
+        self._cond = threading.Condition()
+
+    def _expected_wait(self, position):
+        if self.service_time is None:
+            return 0.0
+        return position / self.max_concurrent * self.service_time
+
+    def _reject(self, reason, message, retry_after):
+        inc("admission_rejected_total", controller=self.name, reason=reason)
+        raise Overloaded(message, retry_after)
+
+    def _update_gauges(self):
+        set_gauge("admission_active", self.active, controller=self.name)
+        set_gauge("admission_waiting", self.waiting, controller=self.name)
+
+    def acquire(self):
+        """Take a slot, waiting up to max_wait; raises Overloaded when shed."""
+        if self.max_concurrent <= 0:
+            return
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            if self.active >= self.max_concurrent:
+                expected = self._expected_wait(self.waiting + 1)
+                if self.waiting >= self.max_queue:
+                    self._reject("queue_full", "Server busy: too many route requests queued",
+                                 expected or self.max_wait)
+                if expected > self.max_wait:
+                    self._reject("deadline", "Server busy: route request would not start in time", expected)
+                self.waiting += 1
+                self._update_gauges()
+                try:
+                    while self.active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject("timeout", "Server busy: timed out waiting to process the route",
+                                         self._expected_wait(self.waiting) or self.max_wait)
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    self._update_gauges()
+            self.active += 1
+            self._update_gauges()
+
+    def release(self, elapsed):
+        if self.max_concurrent <= 0:
+            return
+        with self._cond:
+            self.active -= 1
+            self.service_time = elapsed if self.service_time is None else 0.8 * self.service_time + 0.2 * elapsed
+            self._update_gauges()
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self):
+        """with controller.admit(): ... runs the block in a slot (see acquire)."""
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
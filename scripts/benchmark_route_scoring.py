@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the route-scoring hot path. No Google calls, no API key, no real raster.
+
+Generates a synthetic UTCI raster (.npz, or .tif with --format tif) around Austin in EPSG:6343
+and synthetic encoded polylines, then times each stage separately:
+decode_polyline, interpolate_geopath_equidistant, projection, raster load, sampling, statistics and
+JSON serialization. Reports median/min time, throughput and peak traced memory per stage.
+
+Usage:
+  python benchmark_route_scoring.py                              # defaults, print report
+  python benchmark_route_scoring.py --raster-size 4000 --routes 5 --route-length 3000
+  python benchmark_route_scoring.py --sample-mode corridor --corridor-m 10
+  python benchmark_route_scoring.py --scoring exact
+  python benchmark_route_scoring.py --shared 0.8 --no-shared-segments   # alternatives 80% alike, no dedup
+  python benchmark_route_scoring.py --save-baseline bench_baseline.json
+  python benchmark_route_scoring.py --compare bench_baseline.json --tolerance 0.25
+
+--compare exits with status 1 if any stage's median time regressed by more than --tolerance
+(fraction) against the baseline, so it can gate CI.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import polyline
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from metrics import add_stage_listener
+from utils import decode_polyline, interpolate_geopath_equidistant, create_shapefiles_and_extract_raster_values
+from scoring import compute_route_statistics, build_route_response
+from sampling import SAMPLE_MODES
+from traversal import SCORING_MODES, score_route_exact
+from raster_store import load_raster
+from shared_segments import SharedSegments
+
+# Synthetic data is centred on UT Austin so it falls inside the same UTM zone as the real raster
+CENTER_LAT, CENTER_LON = 30.2849, -97.7341
+RASTER_CRS = "EPSG:6343"
+SPACING_M = 4  # same densification as the backend
+
+STAGES = ["decode", "interpolate", "project", "raster_load", "sample", "traverse", "stats", "serialize"]
+
+
+def make_synthetic_raster(out_dir, size, resolution, fmt, scale=100.0, seed=0):
+    """Write a size x size UTCI raster centred on CENTER_LAT/LON. Returns its path."""
+    from pyproj import Transformer
+    from rasterio.transform import from_origin
+
+    x_c, y_c = Transformer.from_crs("EPSG:4326", RASTER_CRS, always_xy=True).transform(CENTER_LON, CENTER_LAT)
+    half = size * resolution / 2
+    transform = from_origin(x_c - half, y_c + half, resolution, resolution)
+
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:size, 0:size]
+    values = (32 + 4 * np.sin(cols / 40.0) + 3 * np.cos(rows / 55.0)
+              + rng.normal(0, 0.5, (size, size))).astype(np.float32)
+
+    if fmt == "npz":
+        path = os.path.join(out_dir, f"synthetic_utci_{size}.npz")
+        np.savez_compressed(
+            path,
+            values=np.round(values * scale).astype(np.int16),
+            transform=np.array(transform[:6], dtype=np.float64),
+            shape=np.array(values.shape, dtype=np.int32),
+            scale=np.float64(scale),
+        )
+    else:
+        import rasterio
+        path = os.path.join(out_dir, f"synthetic_utci_{size}.tif")
+        with rasterio.open(path, "w", driver="GTiff", height=size, width=size, count=1,
+                           dtype="float32", crs=RASTER_CRS, transform=transform,
+                           tiled=True, blockxsize=256, blockysize=256) as dst:
+            dst.write(values, 1)
+    return path
+
+
+def make_synthetic_polylines(count, length_m, extent_m, vertex_spacing_m=60, seed=0, shared=0.0):
+    """
+    Random-walk walking routes of ~length_m metres starting near the centre, kept inside extent_m.
+    With shared > 0, every route after the first starts with that fraction of the first route's
+    vertices (alternatives leaving the same building) before walking off on its own.
+    """
+    rng = np.random.default_rng(seed)
+    m_per_deg_lat = 111_320.0
+    m_per_deg_lon = 111_320.0 * np.cos(np.radians(CENTER_LAT))
+    limit = extent_m / 2 * 0.9
+    n_vertices = max(int(length_m / vertex_spacing_m), 1) + 1
+    n_shared = int(round(shared * (n_vertices - 1)))
+    encoded = []
+    first = None
+    for _ in range(count):
+        xy = np.zeros((n_vertices, 2))
+        heading = rng.uniform(0, 2 * np.pi)
+        start = 1
+        if first is not None and n_shared:
+            xy[:n_shared + 1] = first[:n_shared + 1]
+            start = n_shared + 1
+        for k in range(start, n_vertices):
+            heading += rng.normal(0, 0.4)
+            step = np.array([np.cos(heading), np.sin(heading)]) * vertex_spacing_m
+            nxt = xy[k - 1] + step
+            if np.any(np.abs(nxt) > limit):
+                heading += np.pi  # bounce off the raster edge
+                nxt = xy[k - 1] - step
+            xy[k] = nxt
+        if first is None:
+            first = xy.copy()
+        lats = CENTER_LAT + xy[:, 1] / m_per_deg_lat
+        lons = CENTER_LON + xy[:, 0] / m_per_deg_lon
+        encoded.append(polyline.encode(list(zip(lats, lons))))
+    return encoded
+
+
+class _StageRecorder:
+    """Collects stage durations (and optionally tracemalloc peaks) reported through metrics.stage_timer."""
+
+    def __init__(self):
+        self.times = {}
+        self.peaks = {}
+        self.trace_memory = False
+        add_stage_listener(self._on_stage)
+
+    def _on_stage(self, stage, event, elapsed):
+        if event == "start":
+            if self.trace_memory:
+                tracemalloc.reset_peak()
+            return
+        self.times[stage] = self.times.get(stage, 0.0) + elapsed
+        if self.trace_memory:
+            self.peaks[stage] = max(self.peaks.get(stage, 0), tracemalloc.get_traced_memory()[1])
+
+    def reset(self):
+        self.times = {}
+        self.peaks = {}
+
+
+def run_pipeline_once(encoded_polylines, raster_path, output_dir, recorder, sample_mode="floor", corridor_m=None,
+                      scoring="points", shared_segments=True):
+    """One pass over the hot path. Returns per-stage seconds for this pass."""
+    from metrics import stage_timer
+
+    recorder.reset()
+    with stage_timer("decode"):
+        decoded = [decode_polyline(p) for p in encoded_polylines]
+    if scoring == "exact":
+        with stage_timer("raster_load"):
+            raster = load_raster(raster_path)
+        with stage_timer("traverse"):
+            scored = [score_route_exact(raster, coords) for coords in decoded]
+        interpolated = [points for points, _, _, _ in scored]
+        with stage_timer("stats"):
+            stats = compute_route_statistics([utci for _, utci, _, _ in scored],
+                                             weights=[weights for _, _, weights, _ in scored])
+    else:
+        shared = None
+        with stage_timer("interpolate"):
+            if shared_segments:
+                shared = SharedSegments(decoded, SPACING_M)
+                interpolated = shared.routes()
+            else:
+                interpolated = [interpolate_geopath_equidistant(coords, SPACING_M) for coords in decoded]
+        # raster_load, sample and write_output are timed inside utils
+        gdfs, _ = create_shapefiles_and_extract_raster_values(interpolated, raster_path, output_dir,
+                                                              sample_mode, corridor_m, shared=shared)
+        with stage_timer("stats"):
+            stats = compute_route_statistics([gdf["raster_value"].to_numpy() for gdf in gdfs], shared=shared)
+    with stage_timer("serialize"):
+        directions = [{"duration": "0 mins", "distance": "0 km"}] * len(interpolated)
+        payload = build_route_response(interpolated, directions, stats,
+                                       (CENTER_LAT, CENTER_LON), (CENTER_LAT, CENTER_LON))
+        body = json.dumps(payload)
+    return dict(recorder.times), sum(len(r) for r in interpolated), len(body)
+
+
+def run_benchmark(args):
+    recorder = _StageRecorder()
+    with tempfile.TemporaryDirectory(prefix="route_bench_") as tmp:
+        raster_path = make_synthetic_raster(tmp, args.raster_size, args.resolution, args.format)
+        encoded = make_synthetic_polylines(args.routes, args.route_length, args.raster_size * args.resolution,
+                                           shared=args.shared)
+        output_dir = os.path.join(tmp, "output")
+
+        mode = (args.sample_mode, args.corridor_m, args.scoring, not args.no_shared_segments)
+        for _ in range(args.warmup):
+            run_pipeline_once(encoded, raster_path, output_dir, recorder, *mode)
+
+        samples = {}
+        n_points = body_bytes = 0
+        for _ in range(args.repeat):
+            times, n_points, body_bytes = run_pipeline_once(encoded, raster_path, output_dir, recorder, *mode)
+            for stage, elapsed in times.items():
+                samples.setdefault(stage, []).append(elapsed)
+
+        # Separate pass for memory: tracemalloc slows allocation-heavy stages, so keep it out of timings
+        peaks = {}
+        if not args.no_memory:
+            tracemalloc.start()
+            recorder.trace_memory = True
+            run_pipeline_once(encoded, raster_path, output_dir, recorder, *mode)
+            recorder.trace_memory = False
+            peaks = dict(recorder.peaks)
+            tracemalloc.stop()
+
+    n_vertices = sum(len(decode_polyline(p)) for p in encoded)
+    units = {
+        "decode": ("vertices", n_vertices),
+        "interpolate": ("points", n_points),
+        "raster_load": ("cells", args.raster_size ** 2),
+        "project": ("points", n_points),
+        "sample": ("points", n_points),
+        "traverse": ("vertices", n_vertices),
+        "stats": ("points", n_points),
+        "serialize": ("bytes", body_bytes),
+    }
+    stages = {}
+    for stage, vals in samples.items():
+        median = float(np.median(vals))
+        unit, n = units.get(stage, ("routes", args.routes))
+        stages[stage] = {
+            "median_s": median,
+            "min_s": float(np.min(vals)),
+            "throughput": (n / median) if median > 0 else None,
+            "throughput_unit": f"{unit}/s",
+            "peak_traced_mb": peaks.get(stage, 0) / (1024 * 1024) if stage in peaks else None,
+        }
+    return {
+        "config": {
+            "raster_size": args.raster_size,
+            "resolution_m": args.resolution,
+            "format": args.format,
+            "routes": args.routes,
+            "route_length_m": args.route_length,
+            "sample_mode": args.sample_mode,
+            "scoring": args.scoring,
+            "shared": args.shared,
+            "shared_segments": not args.no_shared_segments,
+            "repeat": args.repeat,
+            "points": n_points,
+            "response_bytes": body_bytes,
+        },
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine()},
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stages": stages,
+    }
+
+
+def print_report(result):
+    cfg = result["config"]
+    print(f"Raster {cfg['raster_size']}x{cfg['raster_size']} ({cfg['format']}, {cfg['resolution_m']} m), "
+          f"{cfg['routes']} routes x {cfg['route_length_m']} m, {cfg['points']} points, "
+          f"response {cfg['response_bytes'] / 1024:.1f} KB, {cfg['repeat']} repeats")
+    print(f"{'stage':<14}{'median ms':>11}{'min ms':>10}{'throughput':>22}{'peak MB':>10}")
+    ordered = [s for s in STAGES if s in result["stages"]] + sorted(set(result["stages"]) - set(STAGES))
+    for stage in ordered:
+        s = result["stages"][stage]
+        thr = f"{s['throughput']:.3g} {s['throughput_unit']}" if s["throughput"] else "-"
+        peak = f"{s['peak_traced_mb']:.2f}" if s["peak_traced_mb"] is not None else "-"
+        print(f"{stage:<14}{s['median_s'] * 1000:>11.2f}{s['min_s'] * 1000:>10.2f}{thr:>22}{peak:>10}")
+
+
+def compare_to_baseline(result, baseline, tolerance):
+    """Print per-stage change vs baseline. Returns True if no stage regressed beyond tolerance."""
+    if baseline["config"] != result["config"]:
+        print("⚠️  Baseline was recorded with a different config; comparison may not be meaningful.")
+    ok = True
+    print(f"\n{'stage':<14}{'baseline ms':>13}{'now ms':>10}{'change':>10}")
+    for stage, now in result["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base is None or base["median_s"] <= 0:
+            continue
+        change = now["median_s"] / base["median_s"] - 1
+        flag = ""
+        if change > tolerance:
+            ok = False
+            flag = "  REGRESSION"
+        print(f"{stage:<14}{base['median_s'] * 1000:>13.2f}{now['median_s'] * 1000:>10.2f}{change:>+10.1%}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the route-scoring hot path.")
+    parser.add_argument("--raster-size", type=int, default=2000, help="Raster width and height in cells")
+    parser.add_argument("--resolution", type=float, default=1.0, help="Raster cell size in metres")
+    parser.add_argument("--format", choices=["npz", "tif"], default="npz")
+    parser.add_argument("--routes", type=int, default=3, help="Number of synthetic route alternatives")
+    parser.add_argument("--route-length", type=float, default=1500, help="Length of each route in metres")
+    parser.add_argument("--scoring", choices=SCORING_MODES, default="points",
+                        help="points: 4 m samples; exact: length-weighted cell traversal")
+    parser.add_argument("--sample-mode", choices=SAMPLE_MODES, default="floor")
+    parser.add_argument("--corridor-m", type=float, default=None, help="Corridor half-width for --sample-mode corridor")
+    parser.add_argument("--shared", type=float, default=0.0,
+                        help="Fraction of the first route's vertices every other route starts with")
+    parser.add_argument("--no-shared-segments", action="store_true",
+                        help="Densify and sample every route separately (backend SHARED_SEGMENTS=0)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown fraction for --compare")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print_report(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare_to_baseline(result, baseline, args.tolerance):
+            print(f"\nFAIL: at least one stage is more than {args.tolerance:.0%} slower than baseline.")
+            sys.exit(1)
+        print("\nPASS: no stage regressed beyond tolerance.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+# cache_backends.py
+"""
+Pluggable key-value cache backends shared by the geocode, directions and route-result caches.
+
+Every backend stores bytes under string keys and offers the same four calls:
+  get_many(keys) -> [bytes or None, ...]    (a batch costs one round-trip on networked backends)
+  set_many({key: bytes}, ttl=None)          (ttl in seconds; None keeps entries until evicted)
+  get(key) / set(key, value, ttl=None)
+LocalCache and RedisCache, the backends that can sit behind a TieredCache, also offer
+  get_many_with_ttl(keys) -> [(bytes or None, seconds left or None when it never expires), ...]
+
+LocalCache is an in-process LRU bounded by bytes and/or entries. RedisCache talks the Redis
+protocol (RESP) over a small pool of sockets with no client library: get_many is one MGET and
+set_many one pipelined batch of SETs, so either is a single round-trip. Any compatible server
+works (Redis, Valkey, KeyDB, Dragonfly). Network errors are counted and treated as misses, so a
+cache outage never fails a request. TieredCache keeps a LocalCache in front of a shared backend.
+
+make_cache(name, ...) returns a LocalCache, or a TieredCache over RedisCache when CACHE_URL is
+set (e.g. redis://:password@cache-host:6379/0), so every backend instance sees the others' entries.
+Entries read from the shared tier are kept locally only for the TTL they have left there
+(a shared backend without get_many_with_ttl is read with get_many and its entries kept locally
+until evicted).
+Values are the callers' own compact encodings (see utils.pack_directions, result_cache.pack_entry).
+"""
+
+import os
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+
+from metrics import inc
+
+# Shared cache server; unset keeps every cache in-process
+CACHE_URL = os.environ.get('CACHE_URL', '')
+# Namespace for keys on the shared server (several deployments may share one)
+CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'coolroute')
+# Seconds to wait for the shared cache before treating a call as a miss
+CACHE_TIMEOUT = float(os.environ.get('CACHE_TIMEOUT', '0.25'))
+# After a shared cache error, skip the server (every call a miss) for this many seconds
+CACHE_RETRY_AFTER = float(os.environ.get('CACHE_RETRY_AFTER', '5'))
+
+
+class LocalCache:
+    """Thread-safe in-process LRU of bytes values."""
+
+    def __init__(self, max_bytes=None, max_entries=None):
+        """
+        :param max_bytes: Evict least-recently-used entries beyond this many value bytes (None: no limit)
+        :param max_entries: Evict beyond this many entries (None: no limit)
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, expires at or None)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        return [value for value, _ in self.get_many_with_ttl(keys)]
+
+    def get_many_with_ttl(self, keys):
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                item = self._entries.get(key)
+                if item is not None and item[1] is not None and item[1] <= now:
+                    self._drop(key)
+                    item = None
+                if item is None:
+                    values.append((None, None))
+                    continue
+                self._entries.move_to_end(key)
+                values.append((item[0], item[1] - now if item[1] is not None else None))
+        return values
+
+    def set_many(self, items, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            for key, value in items.items():
+                if self.max_bytes is not None and len(value) > self.max_bytes:
+                    continue
+                self._drop(key)
+                self._entries[key] = (value, expires)
+                self._bytes += len(value)
+            while self._entries and ((self.max_bytes is not None and self._bytes > self.max_bytes) or
+                                     (self.max_entries is not None and len(self._entries) > self.max_entries)):
+                _, (value, _) = self._entries.popitem(last=False)
+                self._bytes -= len(value)
+
+    def _drop(self, key):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._bytes -= len(item[0])
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+
+class RespError(Exception):
+    """Error reply from the cache server."""
+
+
+class _RespConnection:
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    def execute(self, commands):
+        """Send every command, then read one reply each (pipelining: one round-trip for the batch)."""
+        out = []
+        for command in commands:
+            out.append(b'*%d\r\n' % len(command))
+            for arg in command:
+                if isinstance(arg, str):
+                    arg = arg.encode('utf-8')
+                elif not isinstance(arg, bytes):
+                    arg = str(arg).encode('ascii')
+                out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(out))
+        return [self._read_reply() for _ in commands]
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("cache server closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            return RespError(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self.reader.read(size + 2)
+            if len(data) != size + 2:
+                raise ConnectionError("cache server closed the connection")
+            return data[:-2]
+        if kind == b'*':
+            size = int(rest)
+            return None if size < 0 else [self._read_reply() for _ in range(size)]
+        raise ConnectionError(f"unexpected cache server reply {line[:20]!r}")
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisCache:
+    """Redis-protocol backend; keys are stored as "<prefix>:<key>"."""
+
+    def __init__(self, url, prefix, timeout=CACHE_TIMEOUT, pool_size=8):
+        """
+        :param url: redis://[:password@]host[:port][/db]
+        :param prefix: Key namespace (e.g. "coolroute:geocode")
+        :param timeout: Socket timeout in seconds
+        :param pool_size: Idle connections kept for reuse
+        """
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.lstrip('/') or 0)
+        self.prefix = prefix + ':'
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle = []
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = _RespConnection(self.host, self.port, self.timeout)
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        for reply in conn.execute(setup) if setup else []:
+            if isinstance(reply, RespError):
+                conn.close()
+                raise reply
+        return conn
+
+    def _execute(self, commands):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        try:
+            replies = conn.execute(commands) if conn is not None else None
+        except (OSError, ConnectionError):
+            # A pooled connection may have been closed by the server (restart, idle timeout): retry once
+            conn.close()
+            replies = None
+        if replies is None:
+            conn = self._connect()
+            try:
+                replies = conn.execute(commands)
+            except Exception:
+                conn.close()
+                raise
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+        return replies
+
+    def _failed(self, op, e):
+        self._down_until = time.monotonic() + CACHE_RETRY_AFTER
+        inc("cache_backend_errors_total", backend="redis", op=op)
+        print(f"⚠️ Shared cache {op} failed ({self.host}:{self.port}): {e}", flush=True)
+
+    def _down(self):
+        return time.monotonic() < self._down_until
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        if self._down():
+            return [None] * len(keys)
+        try:
+            reply = self._execute([('MGET',) + tuple(self.prefix + key for key in keys)])[0]
+            if isinstance(reply, RespError):
+                raise reply
+            return reply
+        except (OSError, ConnectionError, RespError, ValueError) as e:
+            self._failed("get", e)
+            return [None] * len(keys)
+
+    def set_many(self, items, ttl=None):
+        if not items or self._down():
+            return
+        expiry = ('PX', max(1, int(ttl * 1000))) if ttl else ()
+        try:
+            for reply in self._execute([('SET', self.prefix + key, value) + expiry for key, value in items.items()]):
+                if isinstance(reply, RespError):
+                    raise reply
+        except (OSError, ConnectionError, RespError, ValueError) as e:
+            self._failed("set", e)
+
+    def get_many_with_ttl(self, keys):
+        """
+        [(bytes or None, seconds left or None when the entry never expires), ...] in one
+        round-trip (MGET pipelined with a PTTL per key).
+        """
+        if not keys:
+            return []
+        if self._down():
+            return [(None, None)] * len(keys)
+        names = [self.prefix + key for key in keys]
+        try:
+            replies = self._execute([('MGET',) + tuple(names)] + [('PTTL', name) for name in names])
+            for reply in replies:
+                if isinstance(reply, RespError):
+                    raise reply
+            # PTTL is -1 for no expiry and -2 if the key expired after MGET read it
+            return [(value, None if ttl == -1 else max(ttl, 0) / 1000)
+                    for value, ttl in zip(replies[0], replies[1:])]
+        except (OSError, ConnectionError, RespError, ValueError, TypeError) as e:
+            self._failed("get", e)
+            return [(None, None)] * len(keys)
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+
+class TieredCache:
+    """A local LRU in front of a shared backend: local hits cost nothing, misses one shared round-trip."""
+
+    def __init__(self, local, shared, name):
+        self.local = local
+        self.shared = shared
+        self.name = name
+
+    def get_many(self, keys):
+        values = self.local.get_many(keys)
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            missing_keys = [keys[i] for i in missing]
+            if hasattr(self.shared, "get_many_with_ttl"):
+                fetched = self.shared.get_many_with_ttl(missing_keys)
+            else:
+                fetched = [(value, None) for value in self.shared.get_many(missing_keys)]
+            found = 0
+            for i, (value, ttl) in zip(missing, fetched):
+                if value is None:
+                    continue
+                values[i] = value
+                found += 1
+                # The local copy expires with the shared entry (ttl 0: it just expired, do not keep it)
+                if ttl is None or ttl > 0:
+                    self.local.set(keys[i], value, ttl)
+            inc("shared_cache_requests_total", found, cache=self.name, result="hit")
+            inc("shared_cache_requests_total", len(missing) - found, cache=self.name, result="miss")
+        return values
+
+    def set_many(self, items, ttl=None):
+        self.local.set_many(items, ttl)
+        self.shared.set_many(items, ttl)
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+
+def make_shared_cache(name):
+    """The shared server's namespace for one cache, or None when CACHE_URL is not set."""
+    return RedisCache(CACHE_URL, f"{CACHE_PREFIX}:{name}") if CACHE_URL else None
+
+
+def make_cache(name, max_bytes=None, max_entries=None):
+    """
+    In-process LRU, or with CACHE_URL set, the same LRU in front of the shared server.
+
+    :param name: Cache name, used as the key namespace and metrics label (e.g. "geocode")
+    """
+    local = LocalCache(max_bytes, max_entries)
+    shared = make_shared_cache(name)
+    return local if shared is None else TieredCache(local, shared, name)
+
+
+def pack_strings(*values):
+    """Length-prefixed UTF-8 strings (compact and unambiguous; see unpack_strings)."""
+    out = []
+    for value in values:
+        data = value.encode('utf-8')
+        out.append(struct.pack('<I', len(data)))
+        out.append(data)
+    return b''.join(out)
+
+
+def unpack_strings(data, offset=0):
+    """All strings packed by pack_strings from offset on."""
+    values = []
+    while offset < len(data):
+        (size,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        values.append(data[offset:offset + size].decode('utf-8'))
+        offset += size
+    return values
@@ -0,0 +1,218 @@
+# circuit_breaker.py
+"""
+Circuit breaker with stale-while-revalidate fallback for the external (Google) APIs.
+
+CircuitBreaker counts consecutive failures (errors, timeouts, error statuses) of one API. After
+failure_threshold of them it opens: calls stop reaching the API. Once reset_timeout seconds have
+passed, one probe call is let through (half-open); its success closes the breaker, its failure
+re-opens it for another reset_timeout.
+
+GuardedApi puts a breaker and a cache of last good answers in front of a fetch function. A fetch
+returns its result or raises UpstreamError. Answers are kept in a cache backend (cache_backends;
+shared across instances when CACHE_URL is set) with the time they were fetched: answers younger
+than fresh_ttl are served without calling the API, older ones are kept for stale_ttl as fallback.
+When the breaker is closed, calls go to the API and successful answers are remembered; a failed
+call falls back to the remembered answer if there is one (stale-if-error). While the breaker is
+open or half-open, a key with a remembered answer is served from it at once and refreshed in the
+background, and those background refreshes are the probes that close the breaker again. A key with no remembered answer gets UpstreamUnavailable,
+which the backend returns as a 503 with Retry-After. A call shed by the outbound rate limiter
+(admission.Overloaded) also falls back to the remembered answer.
+"""
+
+import struct
+import threading
+import time
+
+from admission import Overloaded
+from metrics import inc, set_gauge
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+# circuit_breaker_state gauge values
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamError(Exception):
+    """An external API call failed: connection error, timeout, HTTP error or error status."""
+
+
+class UpstreamUnavailable(Overloaded):
+    """The external API is failing and there is no cached answer to fall back on."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, reset_timeout):
+        """
+        :param name: Label for metrics (e.g. "geocode")
+        :param failure_threshold: Consecutive failures that open the breaker
+        :param reset_timeout: Seconds the breaker stays open before a probe call is allowed
+        """
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+        set_gauge("circuit_breaker_state", STATE_VALUES[CLOSED], api=name)
+
+    def _transition(self, state):
+        if state == self.state:
+            return
+        print(f"⚡ Circuit breaker {self.name}: {self.state} -> {state}", flush=True)
+        self.state = state
+        set_gauge("circuit_breaker_state", STATE_VALUES[state], api=self.name)
+        inc("circuit_breaker_transitions_total", api=self.name, to=state)
+
+    def allow(self):
+        """True if a call may go to the API now (when half-open, only one probe at a time)."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def retry_after(self):
+        """Seconds until the breaker lets a probe through."""
+        with self._lock:
+            if self.state != OPEN:
+                return 1
+            return self.reset_timeout - (time.monotonic() - self.opened_at)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.probing = False
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        inc("upstream_failures_total", api=self.name)
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition(OPEN)
+
+    def record_skipped(self):
+        """The allowed call never reached the API (e.g. shed by the rate limiter): free the probe."""
+        with self._lock:
+            self.probing = False
+
+
+# call(cached=...) default: look the key up first
+_LOOK_UP = object()
+
+
+class GuardedApi:
+    def __init__(self, breaker, store, pack, unpack, fresh_ttl, stale_ttl):
+        """
+        :param breaker: CircuitBreaker for this API
+        :param store: Cache backend for answers (cache_backends.make_cache)
+        :param pack: answer -> bytes
+        :param unpack: bytes -> answer
+        :param fresh_ttl: Seconds an answer is served without calling the API (0: always call)
+        :param stale_ttl: Seconds an answer is kept as fallback while the API is failing
+        """
+        self.breaker = breaker
+        self.name = breaker.name
+        self.store = store
+        self.pack = pack
+        self.unpack = unpack
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def lookup(self, keys):
+        """{key: (fetched at, answer) or None} for a batch of keys, in one cache round-trip."""
+        found = {}
+        for key, data in zip(keys, self.store.get_many(list(keys))):
+            found[key] = None
+            if data is not None:
+                try:
+                    (fetched_at,) = struct.unpack_from('<d', data)
+                    found[key] = (fetched_at, self.unpack(data[8:]))
+                except (struct.error, ValueError, UnicodeDecodeError):
+                    pass
+        return found
+
+    def _remember(self, key, answer):
+        if not answer:
+            return
+        self.store.set(key, struct.pack('<d', time.time()) + self.pack(answer), self.stale_ttl or None)
+
+    def _fetch(self, key, fetch):
+        """fetch() under the breaker; raises UpstreamError on failure."""
+        try:
+            answer = fetch()
+        except UpstreamError:
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            self.breaker.record_skipped()
+            raise
+        self.breaker.record_success()
+        self._remember(key, answer)
+        return answer
+
+    def _serve_stale(self, key, answer, reason):
+        inc("upstream_stale_served_total", api=self.name, reason=reason)
+        print(f"⚠️ Serving cached {self.name} answer ({reason})", flush=True)
+        return answer
+
+    def _refresh_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                if self.breaker.allow():
+                    self._fetch(key, fetch)
+                    inc("upstream_refreshes_total", api=self.name, result="ok")
+            except Exception:
+                inc("upstream_refreshes_total", api=self.name, result="failed")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def call(self, key, fetch, cached=_LOOK_UP):
+        """
+        The answer for key: remembered while fresh, else fetched, else remembered when the API is failing.
+
+        :param key: Request identity string (e.g. normalized address)
+        :param fetch: Function calling the API; returns the answer or raises UpstreamError
+        :param cached: This key's entry from lookup(), if already looked up in a batch
+        """
+        if cached is _LOOK_UP:
+            cached = self.lookup([key])[key]
+        stale = None
+        if cached is not None:
+            fetched_at, stale = cached
+            if time.time() - fetched_at < self.fresh_ttl:
+                inc("upstream_cache_hits_total", api=self.name)
+                return stale
+        if stale is not None and self.breaker.state != CLOSED:
+            self._refresh_in_background(key, fetch)
+            return self._serve_stale(key, stale, "circuit_open")
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(f"{self.name} service unavailable (circuit open)", self.breaker.retry_after())
+        try:
+            return self._fetch(key, fetch)
+        except UpstreamError as e:
+            if stale is not None:
+                return self._serve_stale(key, stale, "error")
+            raise UpstreamUnavailable(f"{self.name} service unavailable: {e}", self.breaker.retry_after()) from e
+        except Overloaded:
+            # Shed by the outbound rate limiter: the API was not called, but a remembered answer still serves
+            if stale is not None:
+                return self._serve_stale(key, stale, "rate_limited")
+            raise
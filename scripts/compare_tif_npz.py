@@ -18,8 +18,6 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, SCRIPT_DIR)
 os.chdir(SCRIPT_DIR)
 
-os.environ["PROFILE"] = "0"
-
 from utils import (
     get_lat_lon_from_address,
     get_directions_polylines,
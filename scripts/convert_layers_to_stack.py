@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Combine co-registered GeoTIFF layers into one memory-mappable layer stack (.stack.npz).
+
+Every layer must share the UTCI raster's shape, transform and CRS. Values are stored as int16
+(value * scale per layer, -32768 for nodata) in an uncompressed .npz so the backend can
+memory-map it; see layer_stack.py for the layout. When the stack is at scripts/UTCI_1600.stack.npz
+(or UTCI_STACK_PATH), the backend prefers it over the .npz/.tif, reports per-layer route
+statistics and uses the shade layer for shade percentages.
+
+Usage:
+  python convert_layers_to_stack.py --utci UTCI_1600.tif --shade shade.tif --svf svf.tif \\
+      --surface-temp lst.tif -o UTCI_1600.stack.npz
+  python convert_layers_to_stack.py --utci UTCI_1600.tif --layer tree_canopy=canopy.tif:1000
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import rasterio
+
+from layer_stack import LAYER_SCALES, NODATA, STACK_SUFFIX
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(SCRIPT_DIR, "UTCI_1600" + STACK_SUFFIX)
+
+
+def read_layer(path, reference=None):
+    """(float values with NaN for nodata, transform, crs) of band 1, checked against reference."""
+    with rasterio.open(path) as src:
+        values = src.read(1)
+        # Keep float32 bands as float32 so quantization matches convert_utci_to_npz.py bit for bit
+        if not np.issubdtype(values.dtype, np.floating):
+            values = values.astype(np.float64)
+        if src.nodata is not None:
+            values[values == src.nodata] = np.nan
+        transform, crs = src.transform, src.crs
+    if reference is not None:
+        ref_values, ref_transform, ref_crs = reference
+        if values.shape != ref_values.shape or not transform.almost_equals(ref_transform) or crs != ref_crs:
+            print(f"Error: {path} is not co-registered with the UTCI raster "
+                  f"(shape {values.shape} vs {ref_values.shape}, transform or CRS differ)")
+            sys.exit(1)
+    return values, transform, crs
+
+
+def quantize(values, scale):
+    out = np.round(np.nan_to_num(values, nan=0.0) * scale)
+    if np.nanmax(np.abs(values), initial=0) * scale > np.iinfo(np.int16).max:
+        print(f"Error: values up to {np.nanmax(np.abs(values)):.2f} overflow int16 at scale {scale}")
+        sys.exit(1)
+    out = out.astype(np.int16)
+    out[np.isnan(values)] = NODATA
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a co-registered UTCI layer stack.")
+    parser.add_argument("--utci", required=True, help="UTCI GeoTIFF (°C)")
+    parser.add_argument("--shade", help="Shade mask or fraction GeoTIFF (0..1)")
+    parser.add_argument("--svf", help="Sky-view factor GeoTIFF (0..1)")
+    parser.add_argument("--surface-temp", help="Surface temperature GeoTIFF (°C)")
+    parser.add_argument("--layer", action="append", default=[], metavar="NAME=PATH[:SCALE]",
+                        help="Any other layer (repeatable)")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    if not args.output.lower().endswith(STACK_SUFFIX):
+        print(f"Error: output name must end with {STACK_SUFFIX}")
+        sys.exit(1)
+
+    sources = [("utci", args.utci, None), ("shade", args.shade, None), ("svf", args.svf, None),
+               ("surface_temp", args.surface_temp, None)]
+    for spec in args.layer:
+        name, _, rest = spec.partition("=")
+        path, _, scale = rest.partition(":")
+        sources.append((name, path, float(scale) if scale else None))
+
+    reference = None
+    names, bands, scales = [], [], []
+    for name, path, scale in sources:
+        if not path:
+            continue
+        print(f"Reading {name} from {path}...")
+        values, transform, crs = read_layer(path, reference)
+        if reference is None:
+            reference = (values, transform, crs)
+        scale = scale or LAYER_SCALES.get(name, 100.0)
+        names.append(name)
+        bands.append(quantize(values, scale))
+        scales.append(scale)
+
+    stack = np.stack(bands)
+    _, transform, crs = reference
+    print(f"Layers: {', '.join(names)}; shape {stack.shape}; {stack.nbytes / (1024 * 1024):.2f} MB int16")
+    # np.savez (not savez_compressed): stored members can be memory-mapped
+    np.savez(
+        args.output,
+        stack=stack,
+        layers=np.array(names),
+        scales=np.array(scales, dtype=np.float64),
+        transform=np.array([transform.a, transform.b, transform.c, transform.d, transform.e, transform.f]),
+        crs=np.array(crs.to_string() if crs else ""),
+    )
+    print(f"Saved {args.output} ({os.path.getsize(args.output) / (1024 * 1024):.2f} MB)")
+
+
+if __name__ == "__main__":
+    main()
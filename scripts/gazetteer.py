@@ -0,0 +1,214 @@
+# gazetteer.py
+"""
+Offline gazetteer of named places for geocoding and autocomplete without Google calls.
+
+Places come from a CSV (columns name, lat, lon and optional aliases, "|"-separated, and weight)
+or a GeoJSON FeatureCollection of Point features (properties name, optional aliases as a list
+or "|"-separated string, and weight). Names and aliases are normalized like the route cache keys
+(result_cache.normalize_place: case, whitespace and trailing punctuation ignored).
+
+Exact geocodes are a dict lookup on the normalized name or alias. Autocomplete uses a character
+trie over every name and alias, inserted once from each word start ("texas capitol" and
+"capitol"), so a query matches the beginning of any word. Every trie node keeps its best
+TOP_K places (highest weight, then shortest name), so a query costs one walk down the trie
+of len(query) steps, microseconds regardless of how many places there are.
+
+Places Google geocodes are learned under Google's formatted address, never the text the user
+typed, so typos and free-form input are not remembered. A learned place stays pending, in memory
+only and out of autocomplete, until it has been geocoded min_hits times. Then it is added with
+weight 0 (below curated places) and, when a learned-places path is set, appended to that CSV so
+it is loaded again on restart. At most max_learned places are learned, and at most max_learned
+pending places are kept (the least recently seen are dropped).
+"""
+
+import csv
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import inc, set_gauge
+from result_cache import normalize_place
+
+# Places kept per trie node, i.e. the most autocomplete can return
+TOP_K = 10
+CSV_FIELDS = ["name", "lat", "lon", "aliases", "weight"]
+
+
+class Place:
+    __slots__ = ("id", "name", "lat", "lon", "aliases", "weight", "source")
+
+    def __init__(self, id, name, lat, lon, aliases=(), weight=0.0, source="file"):
+        self.id = id
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.aliases = list(aliases)
+        self.weight = weight
+        self.source = source
+
+    def to_dict(self):
+        return {"name": self.name, "lat": self.lat, "lon": self.lon, "source": self.source}
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.top = ()
+
+
+def _split_aliases(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split("|")
+    return [alias.strip() for alias in value if alias and alias.strip()]
+
+
+class Gazetteer:
+    def __init__(self, learned_path=None, max_learned=10000, min_hits=3):
+        """
+        :param learned_path: CSV that learned places are appended to (None: keep them in memory only)
+        :param max_learned: Most places learned from Google (and most kept pending)
+        :param min_hits: Geocodes of a learned place before it is added and offered by autocomplete
+        """
+        self.learned_path = learned_path
+        self.max_learned = max_learned
+        self.min_hits = max(min_hits, 1)
+        self.places = []
+        self.learned = 0
+        self._exact = {}
+        self._pending = OrderedDict()  # normalized name -> [name, lat, lon, hits]
+        self._root = _Node()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.places)
+
+    def _rank(self, place_id):
+        place = self.places[place_id]
+        return -place.weight, len(place.name), place.name
+
+    def _index(self, place, key):
+        """Insert one normalized key from every word start, updating each node's top places."""
+        starts = [0] + [i + 1 for i, ch in enumerate(key) if ch == " "]
+        for start in starts:
+            node = self._root
+            for ch in key[start:]:
+                node = node.children.setdefault(ch, _Node())
+                if place.id not in node.top:
+                    # Replace rather than mutate, so concurrent readers see a consistent tuple
+                    node.top = tuple(sorted(node.top + (place.id,), key=self._rank)[:TOP_K])
+
+    def add(self, name, lat, lon, aliases=(), weight=0.0, source="file"):
+        """Add a place; names or aliases already present keep their first place. Returns the place or None."""
+        with self._lock:
+            keys = [k for k in dict.fromkeys(normalize_place(n) for n in [name, *aliases]) if k and k not in self._exact]
+            if not keys or (source == "learned" and self.learned >= self.max_learned):
+                return None
+            place = Place(len(self.places), name.strip(), float(lat), float(lon), aliases, float(weight), source)
+            self.places.append(place)
+            if source == "learned":
+                self.learned += 1
+            for key in keys:
+                self._exact[key] = place
+                self._index(place, key)
+            set_gauge("gazetteer_places", len(self.places))
+        return place
+
+    def geocode(self, address):
+        """(lat, lon) of a place whose name or alias (or pending learned name) matches address, else None."""
+        key = normalize_place(address)
+        place = self._exact.get(key)
+        if place is None:
+            pending = self._pending.get(key)
+            if pending is not None:
+                # A hit towards adding the place
+                self.learn(*pending[:3])
+                inc("gazetteer_lookups_total", result="pending_hit")
+                return pending[1], pending[2]
+        inc("gazetteer_lookups_total", result="hit" if place is not None else "miss")
+        return (place.lat, place.lon) if place is not None else None
+
+    def autocomplete(self, query, limit=TOP_K):
+        """Best places with a name or alias word starting with query."""
+        node = self._root
+        for ch in normalize_place(query):
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return [self.places[i] for i in node.top[:limit]]
+
+    def learn(self, name, lat, lon):
+        """
+        Count a geocode from Google under its formatted address; added (weight 0, appended to
+        learned_path if set) once seen min_hits times.
+        """
+        key = normalize_place(name)
+        if not key or key in self._exact or not any(ch.isalpha() for ch in name):
+            # Known already, or coordinates rather than a place name
+            return
+        with self._lock:
+            pending = self._pending.pop(key, None) or [name.strip(), float(lat), float(lon), 0]
+            pending[3] += 1
+            if pending[3] < self.min_hits:
+                self._pending[key] = pending
+                while len(self._pending) > self.max_learned:
+                    self._pending.popitem(last=False)
+                return
+        place = self.add(pending[0], pending[1], pending[2], source="learned")
+        if place is None:
+            return
+        inc("gazetteer_learned_total")
+        if self.learned_path:
+            try:
+                with self._lock:
+                    new_file = not os.path.exists(self.learned_path)
+                    os.makedirs(os.path.dirname(self.learned_path) or ".", exist_ok=True)
+                    with open(self.learned_path, "a", newline="", encoding="utf-8") as f:
+                        writer = csv.writer(f)
+                        if new_file:
+                            writer.writerow(CSV_FIELDS)
+                        writer.writerow([place.name, place.lat, place.lon, "", 0])
+            except OSError as e:
+                print(f"⚠️ Could not save learned place {place.name!r}: {e}")
+
+    def load(self, path, source="file"):
+        """Add the places in a .csv or .geojson/.json file; returns how many were added."""
+        if path.lower().endswith((".geojson", ".json")):
+            with open(path, encoding="utf-8") as f:
+                features = json.load(f).get("features", [])
+            rows = []
+            for feature in features:
+                props = feature.get("properties") or {}
+                geometry = feature.get("geometry") or {}
+                if geometry.get("type") != "Point" or not props.get("name"):
+                    continue
+                lon, lat = geometry["coordinates"][:2]
+                rows.append((props["name"], lat, lon, _split_aliases(props.get("aliases")), props.get("weight") or 0))
+        else:
+            with open(path, newline="", encoding="utf-8") as f:
+                rows = [(row["name"], row["lat"], row["lon"], _split_aliases(row.get("aliases")), row.get("weight") or 0)
+                        for row in csv.DictReader(f) if row.get("name")]
+        added = 0
+        for name, lat, lon, aliases, weight in rows:
+            if self.add(name, lat, lon, aliases, weight, source) is not None:
+                added += 1
+        return added
+
+
+def load_gazetteer(path, learned_path=None, max_learned=10000, min_hits=3):
+    """Gazetteer from path (if it exists) plus previously learned places (see Gazetteer)."""
+    gazetteer = Gazetteer(learned_path, max_learned, min_hits)
+    for file_path, source in ((path, "file"), (learned_path, "learned")):
+        if not file_path or not os.path.exists(file_path):
+            continue
+        try:
+            added = gazetteer.load(file_path, source)
+            print(f"✓ Gazetteer: {added} places from {os.path.basename(file_path)}")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"✗ Could not load gazetteer {file_path}: {e}")
+    set_gauge("gazetteer_places", len(gazetteer))
+    return gazetteer
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Google Geocoding and Directions APIs, for load tests without API quota.
+
+Serves the same JSON shapes that get_lat_lon_from_address and get_directions_polylines consume:
+  GET /maps/api/geocode/json?address=...&key=...
+  GET /maps/api/directions/json?origin=lat,lng&destination=lat,lng&mode=walking&alternatives=true&key=...
+
+Geocodes are deterministic: known places (--places JSON {"name": [lat, lng]}) resolve to their
+coordinates, anything else hashes to a point inside the Austin core. Directions return the
+polylines from --polylines (JSON list of encoded strings) if given, otherwise --alternatives
+generated zig-zag walking routes between origin and destination.
+
+To exercise the backend's timeouts and circuit breakers, --error-rate makes that share of calls
+fail with --error-status (an HTTP code such as 500, or a Google status such as OVER_QUERY_LIMIT),
+and a large --latency-ms makes calls time out. Both can be changed while the stub runs:
+  curl -X POST localhost:5002/stub/config -H 'Content-Type: application/json' -d '{"error_rate": 1}'
+
+Usage:
+  python google_api_stub.py --port 5002 --latency-ms 80 --jitter-ms 40
+  GOOGLE_MAPS_API_BASE=http://localhost:5002 python backend.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import time
+
+import polyline
+from flask import Flask, jsonify, request
+
+# Austin core (downtown + UT campus); unknown addresses hash into this box
+BBOX = (30.262, -97.752, 30.292, -97.728)  # min_lat, min_lon, max_lat, max_lon
+
+DEFAULT_PLACES = {
+    "ut tower, austin": (30.28612, -97.73941),
+    "texas capitol, austin": (30.27467, -97.74035),
+}
+
+app = Flask(__name__)
+config = {
+    "latency_ms": 0.0,
+    "jitter_ms": 0.0,
+    "alternatives": 3,
+    "places": dict(DEFAULT_PLACES),
+    "polylines": None,
+    "error_rate": 0.0,
+    "error_status": "500",
+}
+# Settings that POST /stub/config may change at runtime
+RUNTIME_SETTINGS = ("latency_ms", "jitter_ms", "error_rate", "error_status")
+
+
+def _sleep():
+    delay = config["latency_ms"] + random.uniform(-1, 1) * config["jitter_ms"]
+    if delay > 0:
+        time.sleep(delay / 1000.0)
+
+
+def _failure(empty_field):
+    """An error response for --error-rate of calls, else None."""
+    if random.random() >= config["error_rate"]:
+        return None
+    status = str(config["error_status"])
+    if status.isdigit():
+        return jsonify({"error": "stub failure"}), int(status)
+    return jsonify({"status": status, empty_field: [], "error_message": "stub failure"})
+
+
+def geocode_address(address):
+    """Deterministic (lat, lng) for an address string."""
+    key = " ".join(address.lower().split())
+    if key in config["places"]:
+        return tuple(config["places"][key])
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    fx = int.from_bytes(digest[:4], "big") / 2**32
+    fy = int.from_bytes(digest[4:8], "big") / 2**32
+    min_lat, min_lon, max_lat, max_lon = BBOX
+    return (round(min_lat + fy * (max_lat - min_lat), 7), round(min_lon + fx * (max_lon - min_lon), 7))
+
+
+def generate_routes(origin, destination, n):
+    """n walking-style alternatives: a grid-like zig-zag route and offset variants of it."""
+    (lat1, lon1), (lat2, lon2) = origin, destination
+    routes = []
+    for k in range(n):
+        offset = (k - (n - 1) / 2) * 0.0015
+        steps = 6
+        points = [(lat1, lon1)]
+        for s in range(1, steps):
+            f = s / steps
+            lat = lat1 + (lat2 - lat1) * f + offset * (1 - abs(2 * f - 1))
+            lon = lon1 + (lon2 - lon1) * f - offset * (1 - abs(2 * f - 1))
+            # Alternate north-south / east-west legs like a street grid
+            prev_lat, prev_lon = points[-1]
+            points.append((lat, prev_lon) if s % 2 else (prev_lat, lon))
+            points.append((lat, lon))
+        points.append((lat2, lon2))
+        routes.append(polyline.encode(points))
+    return routes
+
+
+def _parse_latlng(value):
+    lat, lng = (float(v) for v in value.split(","))
+    return lat, lng
+
+
+@app.route("/maps/api/geocode/json")
+def geocode():
+    _sleep()
+    failure = _failure("results")
+    if failure is not None:
+        return failure
+    address = request.args.get("address", "")
+    if not address:
+        return jsonify({"status": "INVALID_REQUEST", "results": []})
+    lat, lng = geocode_address(address)
+    return jsonify({
+        "status": "OK",
+        "results": [{
+            "formatted_address": address,
+            "geometry": {"location": {"lat": lat, "lng": lng}, "location_type": "APPROXIMATE"},
+        }],
+    })
+
+
+@app.route("/maps/api/directions/json")
+def directions():
+    _sleep()
+    failure = _failure("routes")
+    if failure is not None:
+        return failure
+    try:
+        origin = _parse_latlng(request.args["origin"])
+        destination = _parse_latlng(request.args["destination"])
+    except (KeyError, ValueError):
+        return jsonify({"status": "INVALID_REQUEST", "routes": []})
+
+    encoded = config["polylines"] or generate_routes(origin, destination, config["alternatives"])
+    routes = []
+    for points in encoded:
+        coords = polyline.decode(points)
+        # Rough walking estimate so duration/distance text looks like Google's
+        metres = sum(
+            (((a[0] - b[0]) * 111_320) ** 2 + ((a[1] - b[1]) * 96_000) ** 2) ** 0.5
+            for a, b in zip(coords, coords[1:])
+        )
+        routes.append({
+            "overview_polyline": {"points": points},
+            "legs": [{
+                "duration": {"text": f"{max(int(metres / 80), 1)} mins", "value": int(metres / 1.33)},
+                "distance": {"text": f"{metres / 1000:.1f} km", "value": int(metres)},
+            }],
+        })
+    return jsonify({"status": "OK", "routes": routes})
+
+
+@app.route("/stub/config", methods=["GET", "POST"])
+def stub_config():
+    """Read or change latency/jitter/error settings without restarting (for outage drills)."""
+    if request.method == "POST":
+        updates = request.get_json(silent=True) or {}
+        for name in RUNTIME_SETTINGS:
+            if name in updates:
+                config[name] = str(updates[name]) if name == "error_status" else float(updates[name])
+        print("Stub config: " + ", ".join(f"{name}={config[name]}" for name in RUNTIME_SETTINGS))
+    return jsonify({name: config[name] for name in RUNTIME_SETTINGS})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Google Geocoding/Directions stand-in.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5002)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean added latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- jitter around the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls (0..1) that fail")
+    parser.add_argument("--error-status", default="500",
+                        help="How failing calls fail: an HTTP status code or a Google status (e.g. OVER_QUERY_LIMIT)")
+    parser.add_argument("--alternatives", type=int, default=3, help="Generated routes per directions call")
+    parser.add_argument("--places", help='JSON file {"place name": [lat, lng], ...}')
+    parser.add_argument("--polylines", help="JSON file with a list of encoded polylines to return for every directions call")
+    args = parser.parse_args()
+
+    config["latency_ms"] = args.latency_ms
+    config["jitter_ms"] = args.jitter_ms
+    config["alternatives"] = args.alternatives
+    config["error_rate"] = args.error_rate
+    config["error_status"] = args.error_status
+    if args.places:
+        with open(args.places) as f:
+            config["places"].update({" ".join(k.lower().split()): v for k, v in json.load(f).items()})
+    if args.polylines:
+        with open(args.polylines) as f:
+            config["polylines"] = json.load(f)
+
+    print(f"Google API stub on http://{args.host}:{args.port} "
+          f"(latency {args.latency_ms}±{args.jitter_ms} ms, {args.alternatives} alternatives, "
+          f"error rate {args.error_rate})")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
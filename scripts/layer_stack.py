@@ -0,0 +1,143 @@
+# layer_stack.py
+"""
+Co-registered raster layers (UTCI, shade, sky-view factor, surface temperature) in one file.
+
+A stack is an uncompressed .npz (written with np.savez, see convert_layers_to_stack.py) named
+*.stack.npz with:
+  stack      int16 (n_layers, H, W)   layer value * scale, NODATA where missing
+  layers     str (n_layers,)          layer names; "utci" is required
+  scales     float64 (n_layers,)      divide by these to get physical values
+  transform  float64 (6,)             shared affine transform
+  crs        str (optional)           defaults to raster_store.DEFAULT_CRS
+
+Because the members are stored, not deflated, the stack member is memory-mapped straight out of
+the zip: opening is instant and only the pages under the routes are read. Sampling computes each
+point's (row, col) once and gathers every layer with a single fancy-index, stack[:, rows, cols].
+
+Known layers: "utci" (°C), "shade" (shade mask or fraction, 0..1), "svf" (sky-view factor, 0..1),
+"surface_temp" (°C). Other names are sampled and reported too.
+"""
+
+import os
+import struct
+import threading
+import zipfile
+
+import numpy as np
+
+from raster_store import DEFAULT_CRS, raster_version
+
+STACK_SUFFIX = ".stack.npz"
+NODATA = np.iinfo(np.int16).min
+# Default int16 scale per known layer (unknown layers use 100)
+LAYER_SCALES = {"utci": 100.0, "shade": 10000.0, "svf": 10000.0, "surface_temp": 100.0}
+
+_lock = threading.Lock()
+_stacks = {}  # path -> LayerStack
+
+
+def is_stack(path):
+    return path is not None and path.lower().endswith(STACK_SUFFIX)
+
+
+def memmap_npz_member(path, name):
+    """Read-only np.memmap of an uncompressed .npz member (falls back to loading it if deflated)."""
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(f"{name}.npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        print(f"⚠️  {os.path.basename(path)}: '{name}' is compressed; loading it into memory "
+              f"(write stacks with np.savez to memory-map them)", flush=True)
+        return np.load(path, allow_pickle=False)[name]
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_len, extra_len = struct.unpack("<HH", local_header[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        if np.lib.format.read_magic(f) == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape, offset=offset,
+                     order="F" if fortran_order else "C")
+
+
+class LayerStack:
+    def __init__(self, path, version):
+        from rasterio.transform import Affine
+
+        meta = np.load(path, allow_pickle=False)
+        self.path = path
+        self.version = version
+        self.layers = [str(name) for name in meta["layers"]]
+        if "utci" not in self.layers:
+            raise ValueError(f"{path}: layer stack has no 'utci' layer")
+        self.scales = np.asarray(meta["scales"], dtype=np.float64)
+        self.transform = Affine(*meta["transform"].tolist()[:6])
+        self.crs = (str(meta["crs"]) if "crs" in meta else "") or DEFAULT_CRS
+        self.stack = memmap_npz_member(path, "stack")
+        self.shape = self.stack.shape[1:]
+
+    def layer(self, name):
+        """Stored (int16) band of one layer, still memory-mapped."""
+        return self.stack[self.layers.index(name)]
+
+    def sample(self, x, y):
+        """
+        Every layer at the cell under each projected point (floor, clamped to the raster edge, as
+        the single-raster path).
+
+        :return: dict layer name -> float64 values, NaN where the layer has no data
+        """
+        inv = ~self.transform
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        h, w = self.shape
+        rows = np.clip(np.floor(inv.d * x + inv.e * y + inv.f), 0, h - 1).astype(np.intp)
+        cols = np.clip(np.floor(inv.a * x + inv.b * y + inv.c), 0, w - 1).astype(np.intp)
+        raw = self.stack[:, rows, cols]  # (n_layers, n_points) in one gather
+        values = raw / self.scales[:, None]
+        values[raw == NODATA] = np.nan
+        return dict(zip(self.layers, values))
+
+
+def open_stack(path):
+    """Process-wide LayerStack for path, reopened when the file's content version changes."""
+    version = raster_version(path)
+    with _lock:
+        stack = _stacks.get(path)
+        if stack is None or stack.version != version:
+            stack = _stacks[path] = LayerStack(path, version)
+            print(f"Opened layer stack {os.path.basename(path)} {stack.shape} layers={','.join(stack.layers)}",
+                  flush=True)
+    return stack
+
+
+def layer_statistics(route_layers, weights=None):
+    """
+    Per-route mean/min/max of every non-UTCI layer, ignoring cells without data.
+
+    :param route_layers: List (one per route) of dicts layer name -> values
+    :param weights: Optional per-route sample weights (see scoring.compute_route_statistics)
+    :return: dict layer name -> {'mean': [...], 'min': [...], 'max': [...]} (None where a route has no data)
+    """
+    out = {}
+    for name in route_layers[0] if route_layers else ():
+        if name == "utci":
+            continue
+        stats = {"mean": [], "min": [], "max": []}
+        for i, layers in enumerate(route_layers):
+            values = np.asarray(layers[name], dtype=np.float64)
+            w = np.ones(len(values)) if weights is None else np.asarray(weights[i], dtype=np.float64)
+            valid = ~np.isnan(values)
+            if not valid.any():
+                stats["mean"].append(None)
+                stats["min"].append(None)
+                stats["max"].append(None)
+                continue
+            w_valid = w[valid] if w[valid].sum() > 0 else np.ones(np.count_nonzero(valid))
+            stats["mean"].append(float(np.average(values[valid], weights=w_valid)))
+            stats["min"].append(float(values[valid].min()))
+            stats["max"].append(float(values[valid].max()))
+        out[name] = stats
+    return out
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Load generator for /api/process-route. Reports latency percentiles, throughput and error rates.
+
+Run the backend against google_api_stub.py so no API quota is spent:
+  python google_api_stub.py --port 5002 --latency-ms 80 &
+  GOOGLE_MAPS_API_BASE=http://localhost:5002 python backend.py &
+  python load_test.py --concurrency 16 --duration 30
+
+Origin/destination pairs come from --pairs (JSON list of [origin, destination]) or are generated
+from --unique-pairs synthetic addresses; --repeat-ratio sends that fraction of requests to the
+first pair, to exercise caching and request coalescing.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+DEFAULT_PAIRS = [
+    ["UT Tower, Austin", "Texas Capitol, Austin"],
+    ["Texas Capitol, Austin", "UT Tower, Austin"],
+]
+
+
+def build_pairs(args):
+    if args.pairs:
+        with open(args.pairs) as f:
+            return [tuple(p) for p in json.load(f)]
+    if args.unique_pairs:
+        return [(f"{100 + i} Guadalupe St, Austin", f"{2000 + i} Speedway, Austin") for i in range(args.unique_pairs)]
+    return [tuple(p) for p in DEFAULT_PAIRS]
+
+
+def run_load(args):
+    pairs = build_pairs(args)
+    url = args.url.rstrip("/") + "/api/process-route"
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    remaining = [args.requests] if not deadline else None
+    lock = threading.Lock()
+    latencies = []
+    statuses = Counter()
+    response_bytes = [0]
+    rng = random.Random(args.seed)
+
+    def next_pair():
+        with lock:
+            if remaining is not None:
+                if remaining[0] <= 0:
+                    return None
+                remaining[0] -= 1
+            elif time.perf_counter() >= deadline:
+                return None
+            if rng.random() < args.repeat_ratio:
+                return pairs[0]
+            return rng.choice(pairs)
+
+    def worker():
+        session = requests.Session()
+        while True:
+            pair = next_pair()
+            if pair is None:
+                return
+            t = time.perf_counter()
+            try:
+                r = session.post(url, json={"origin": pair[0], "destination": pair[1]}, timeout=args.timeout)
+                status = str(r.status_code)
+                size = len(r.content)
+            except requests.RequestException as e:
+                status = type(e).__name__
+                size = 0
+            elapsed = time.perf_counter() - t
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+                response_bytes[0] += size
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - t_start
+    return latencies, statuses, response_bytes[0], wall
+
+
+def report(latencies, statuses, total_bytes, wall, concurrency):
+    n = len(latencies)
+    if n == 0:
+        print("No requests completed.")
+        return
+    lat_ms = np.asarray(latencies) * 1000
+    ok = sum(c for s, c in statuses.items() if s.isdigit() and int(s) < 400)
+    print(f"Requests: {n} in {wall:.1f}s at concurrency {concurrency}")
+    print(f"Throughput: {n / wall:.2f} req/s ({ok / wall:.2f} successful req/s), "
+          f"{total_bytes / wall / 1024:.1f} KB/s received")
+    p50, p90, p95, p99 = np.percentile(lat_ms, [50, 90, 95, 99])
+    print(f"Latency ms: p50={p50:.1f} p90={p90:.1f} p95={p95:.1f} p99={p99:.1f} "
+          f"max={lat_ms.max():.1f} mean={lat_ms.mean():.1f}")
+    print(f"Error rate: {(n - ok) / n:.2%}")
+    print("Status codes: " + ", ".join(f"{s}={c}" for s, c in sorted(statuses.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive /api/process-route at a target concurrency.")
+    parser.add_argument("--url", default="http://localhost:5001", help="Backend base URL")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=0, help="Seconds to run (overrides --requests)")
+    parser.add_argument("--requests", type=int, default=100, help="Total requests when --duration is not set")
+    parser.add_argument("--pairs", help="JSON file with a list of [origin, destination] pairs")
+    parser.add_argument("--unique-pairs", type=int, default=0, help="Generate this many distinct synthetic pairs")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Fraction of requests sent to the first pair")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH", help="Also write raw latencies and status counts to JSON")
+    args = parser.parse_args()
+
+    latencies, statuses, total_bytes, wall = run_load(args)
+    report(latencies, statuses, total_bytes, wall, args.concurrency)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"latencies_s": latencies, "statuses": statuses, "wall_s": wall,
+                       "concurrency": args.concurrency, "bytes": total_bytes}, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# memory_profile.py
+"""
+Opt-in memory profiling of requests and pipeline stages: RSS and tracemalloc allocations.
+
+Set MEMORY_PROFILE=1 to profile a sample of requests (MEMORY_PROFILE_SAMPLE_RATE, default 0.05).
+Only one request is profiled at a time. tracemalloc is started when that request begins and
+stopped when it ends, so the requests that are not sampled run without tracing overhead.
+Traced memory is what was allocated while the request ran. That includes other threads'
+allocations, so under concurrent load the per-request numbers are upper bounds.
+
+For the request and for each pipeline stage (metrics.stage_timer) a profile records:
+  alloc_peak   highest traced memory above the level at the start (transient frames, copies)
+  alloc_net    traced memory still held at the end (what the stage leaves behind)
+  rss_delta    change in resident set size; rss_peak: largest RSS seen at a stage boundary
+  rss_growth   how much the process's RSS high-water mark rose (ru_maxrss)
+
+The top allocation sites (file:line) are taken from a tracemalloc snapshot at the end of the
+stage where the request's traced memory reaches a new high. The snapshot only holds blocks
+allocated since the request started, so it is cheap compared with tracing a whole process.
+report() aggregates everything per stage, per endpoint and per site, and adds the last
+MEMORY_PROFILE_RECENT profiles. The backend serves it at GET /api/debug/memory.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from metrics import add_stage_listener, inc, observe
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MEMORY_PROFILE = os.environ.get('MEMORY_PROFILE', '0') == '1'
+MEMORY_PROFILE_SAMPLE_RATE = float(os.environ.get('MEMORY_PROFILE_SAMPLE_RATE', '0.05'))
+# Allocation sites kept per profile, and in the report
+MEMORY_PROFILE_TOP = int(os.environ.get('MEMORY_PROFILE_TOP', '15'))
+MEMORY_PROFILE_RECENT = int(os.environ.get('MEMORY_PROFILE_RECENT', '50'))
+# Distinct allocation sites aggregated across profiles before the smallest are dropped
+MAX_SITES = 1000
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+# ru_maxrss is in KiB on Linux, bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+_local = threading.local()
+_active = threading.Lock()  # held while a request is being profiled
+_lock = threading.Lock()
+_listening = False
+_recent = deque(maxlen=MEMORY_PROFILE_RECENT)
+_stage_totals = {}     # stage -> aggregate
+_endpoint_totals = {}  # endpoint -> aggregate
+_sites = {}            # "file:line" -> {"peak_bytes", "total_bytes", "profiles"}
+_profiled = 0
+
+
+def current_rss():
+    """Resident set size in bytes (None where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT if resource is not None else None
+
+
+def _mark():
+    """Traced memory, RSS and RSS high-water mark now."""
+    return {'traced': tracemalloc.get_traced_memory()[0], 'rss': current_rss(), 'max_rss': _max_rss()}
+
+
+def _checkpoint(profile):
+    """Credit the traced peak since the last stage boundary to every open frame, then reset it."""
+    peak = tracemalloc.get_traced_memory()[1]
+    for frame in profile['open']:
+        frame['peak'] = max(frame['peak'], peak)
+    tracemalloc.reset_peak()
+
+
+def _measure(start, end, peak):
+    def diff(key):
+        return end[key] - start[key] if start[key] is not None and end[key] is not None else None
+
+    rss = [value for value in (start['rss'], end['rss']) if value is not None]
+    return {
+        'alloc_peak': max(peak - start['traced'], 0),
+        'alloc_net': end['traced'] - start['traced'],
+        'rss_delta': diff('rss'),
+        'rss_peak': max(rss) if rss else None,
+        'rss_growth': diff('max_rss'),
+    }
+
+
+def _top_sites():
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    sites = []
+    for stat in snapshot.statistics('lineno')[:MEMORY_PROFILE_TOP]:
+        frame = stat.traceback[0]
+        sites.append({'site': f"{os.path.basename(frame.filename)}:{frame.lineno}", 'file': frame.filename,
+                      'bytes': stat.size, 'blocks': stat.count})
+    return sites
+
+
+def _on_stage(stage, event, elapsed):
+    profile = getattr(_local, "profile", None)
+    if profile is None or profile['done']:
+        return
+    _checkpoint(profile)
+    if event == "start":
+        mark = _mark()
+        profile['open'].append({'stage': stage, 'start': mark, 'peak': mark['traced']})
+        return
+    frame = next((f for f in reversed(profile['open']) if f['stage'] == stage), None)
+    if frame is None:
+        return
+    profile['open'].remove(frame)
+    mark = _mark()
+    entry = {'stage': stage, 'seconds': elapsed, **_measure(frame['start'], mark, frame['peak'])}
+    profile['stages'].append(entry)
+    observe("stage_memory_peak_bytes", entry['alloc_peak'], stage=stage)
+    # Sites are worth a snapshot only when the request holds more than at any earlier stage end
+    if mark['traced'] > profile['snapshot_traced']:
+        profile['snapshot_traced'] = mark['traced']
+        profile['top_sites'] = _top_sites()
+        profile['top_sites_stage'] = stage
+
+
+def enable(sample_rate=None):
+    """Turn profiling on (optionally changing the sample rate), e.g. from a debug shell."""
+    global MEMORY_PROFILE, MEMORY_PROFILE_SAMPLE_RATE, _listening
+    MEMORY_PROFILE = True
+    if sample_rate is not None:
+        MEMORY_PROFILE_SAMPLE_RATE = sample_rate
+    if not _listening:
+        add_stage_listener(_on_stage)
+        _listening = True
+
+
+def begin(endpoint):
+    """
+    Start profiling the current request if profiling is on, it is sampled and no other request is
+    being profiled. Returns the profile (pass it to end) or None.
+    """
+    if not MEMORY_PROFILE or random.random() >= MEMORY_PROFILE_SAMPLE_RATE:
+        return None
+    if not _active.acquire(blocking=False):
+        return None
+    owns_tracing = not tracemalloc.is_tracing()
+    if owns_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    mark = _mark()
+    profile = {'endpoint': endpoint, 'time': time.time(), 'owns_tracing': owns_tracing, 'done': False,
+               'started': time.perf_counter(), 'open': [], 'stages': [], 'top_sites': [],
+               'top_sites_stage': None, 'snapshot_traced': mark['traced']}
+    profile['request_frame'] = {'stage': None, 'start': mark, 'peak': mark['traced']}
+    profile['open'].append(profile['request_frame'])
+    _local.profile = profile
+    return profile
+
+
+def end(profile):
+    """Finish a profile from begin(): stop tracing and add it to the report."""
+    global _profiled
+    if profile is None:
+        return
+    try:
+        _checkpoint(profile)
+        mark = _mark()
+        if not profile['top_sites']:
+            profile['top_sites'] = _top_sites()
+        request_frame = profile['request_frame']
+        result = {
+            'endpoint': profile['endpoint'], 'time': profile['time'],
+            'seconds': time.perf_counter() - profile['started'],
+            **_measure(request_frame['start'], mark, request_frame['peak']),
+            'stages': profile['stages'], 'top_sites': profile['top_sites'],
+            'top_sites_stage': profile['top_sites_stage'],
+        }
+    finally:
+        profile['done'] = True
+        _local.profile = None
+        if profile['owns_tracing']:
+            tracemalloc.stop()
+        _active.release()
+
+    observe("request_memory_peak_bytes", result['alloc_peak'], endpoint=result['endpoint'])
+    inc("memory_profiles_total", endpoint=result['endpoint'])
+    with _lock:
+        _profiled += 1
+        _recent.append(result)
+        _add(_endpoint_totals, result['endpoint'], result)
+        for stage in result['stages']:
+            _add(_stage_totals, stage['stage'], stage)
+        for site in result['top_sites']:
+            total = _sites.setdefault(site['site'], {'peak_bytes': 0, 'total_bytes': 0, 'profiles': 0})
+            total['peak_bytes'] = max(total['peak_bytes'], site['bytes'])
+            total['total_bytes'] += site['bytes']
+            total['profiles'] += 1
+        if len(_sites) > MAX_SITES:
+            for name in sorted(_sites, key=lambda s: _sites[s]['total_bytes'])[:len(_sites) - MAX_SITES]:
+                del _sites[name]
+
+
+def _add(totals, key, entry):
+    total = totals.setdefault(key, {'count': 0, 'alloc_peak_sum': 0, 'alloc_peak_max': 0, 'alloc_net_sum': 0,
+                                    'rss_delta_sum': 0, 'rss_peak_max': 0, 'rss_growth_sum': 0, 'seconds_sum': 0.0})
+    total['count'] += 1
+    total['alloc_peak_sum'] += entry['alloc_peak']
+    total['alloc_peak_max'] = max(total['alloc_peak_max'], entry['alloc_peak'])
+    total['alloc_net_sum'] += entry['alloc_net']
+    total['rss_delta_sum'] += entry['rss_delta'] or 0
+    total['rss_peak_max'] = max(total['rss_peak_max'], entry['rss_peak'] or 0)
+    total['rss_growth_sum'] += entry['rss_growth'] or 0
+    total['seconds_sum'] += entry['seconds']
+
+
+def _summarize(total):
+    count = total['count']
+    return {
+        'count': count,
+        'alloc_peak_mean': total['alloc_peak_sum'] / count,
+        'alloc_peak_max': total['alloc_peak_max'],
+        'alloc_net_mean': total['alloc_net_sum'] / count,
+        'rss_delta_mean': total['rss_delta_sum'] / count,
+        'rss_peak_max': total['rss_peak_max'],
+        'rss_growth_total': total['rss_growth_sum'],
+        'seconds_mean': total['seconds_sum'] / count,
+    }
+
+
+def report(recent=10):
+    """Profiling state and aggregates (bytes), with the last `recent` profiles (newest first)."""
+    with _lock:
+        stages = {stage: _summarize(total) for stage, total in _stage_totals.items()}
+        endpoints = {endpoint: _summarize(total) for endpoint, total in _endpoint_totals.items()}
+        sites = sorted(({'site': site, **total} for site, total in _sites.items()),
+                       key=lambda s: s['peak_bytes'], reverse=True)[:MEMORY_PROFILE_TOP]
+        profiles = list(_recent)[::-1][:max(recent, 0)]
+        profiled = _profiled
+    return {
+        'enabled': MEMORY_PROFILE,
+        'sample_rate': MEMORY_PROFILE_SAMPLE_RATE,
+        'profiled_requests': profiled,
+        'rss': current_rss(),
+        'max_rss': _max_rss(),
+        'endpoints': endpoints,
+        'stages': dict(sorted(stages.items(), key=lambda item: item[1]['alloc_peak_max'], reverse=True)),
+        'top_sites': sites,
+        'recent': profiles,
+    }
+
+
+if MEMORY_PROFILE:
+    enable()
@@ -0,0 +1,201 @@
+# metrics.py
+"""
+In-process latency metrics for the route pipeline, exposed in Prometheus text format.
+
+Each pipeline stage (geocode, directions, decode, interpolate, raster_load, sample,
+stats, serialize, ...) keeps a summary of its recent durations. Quantiles are computed
+over a sliding window of the last WINDOW_SIZE observations; _sum and _count are
+cumulative since process start, as Prometheus expects.
+
+Usage:
+    from metrics import stage_timer, count_request, render_prometheus
+
+    with stage_timer("geocode"):
+        ...
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+WINDOW_SIZE = int(os.environ.get("METRICS_WINDOW_SIZE", "2048"))
+QUANTILES = (0.5, 0.9, 0.99)
+PREFIX = "route_planner"
+
+HELP = {
+    "stage_duration_seconds": "Duration of each route pipeline stage.",
+    "stage_errors_total": "Pipeline stages that raised an exception.",
+    "requests_total": "HTTP requests handled, by endpoint.",
+    "request_errors_total": "HTTP requests that returned an error status, by endpoint.",
+    "request_duration_seconds": "End-to-end request duration, by endpoint.",
+    "result_cache_requests_total": "Route result cache lookups, by result (hit/shared_hit/miss).",
+    "result_cache_evictions_total": "Route results evicted from the cache to stay under its byte limit.",
+    "result_cache_bytes": "Bytes of serialized route results held in the cache.",
+    "result_cache_entries": "Route results held in the cache.",
+    "tile_cache_requests_total": "In-memory tile cache lookups, by result (hit/miss).",
+    "tile_cache_evictions_total": "Tiles evicted from the in-memory cache to stay under its byte limit.",
+    "tile_cache_bytes": "Bytes of PNG tiles held in memory.",
+    "tile_cache_entries": "PNG tiles held in memory.",
+    "tile_disk_cache_hits_total": "Tiles served from the on-disk cache after an in-memory miss.",
+    "tile_disk_cache_evictions_total": "Least recently used tiles deleted to keep the on-disk cache under its byte limit.",
+    "singleflight_coalesced_total": "Requests that waited on an identical in-flight computation instead of running their own.",
+    "singleflight_timeouts_total": "Coalesced requests that gave up waiting for the shared computation.",
+    "admission_rejected_total": "Route computations shed with a 503, by reason (queue_full/deadline/timeout).",
+    "admission_active": "Route computations running.",
+    "admission_waiting": "Route computations waiting for a slot.",
+    "outbound_rate_limited_total": "Google API calls refused by the outbound rate limiter, by api.",
+    "outbound_rate_limit_wait_seconds_total": "Time spent waiting for outbound rate limiter tokens, by api.",
+    "circuit_breaker_state": "External API circuit breaker state by api (0 closed, 1 half-open, 2 open).",
+    "circuit_breaker_transitions_total": "External API circuit breaker state changes, by api and new state.",
+    "upstream_failures_total": "External API calls that failed (error, timeout or error status), by api.",
+    "upstream_stale_served_total": "Cached external API answers served while the API was failing or rate limited, by api and reason.",
+    "upstream_refreshes_total": "Background refreshes of cached external API answers, by api and result.",
+    "upstream_cache_hits_total": "Geocodes and directions reused from the cache instead of calling Google, by api.",
+    "shared_cache_requests_total": "Lookups that missed the in-process cache and went to the shared cache, by cache and result.",
+    "cache_backend_errors_total": "Shared cache calls that failed and were treated as misses, by op.",
+    "gazetteer_places": "Places in the local gazetteer (loaded and learned).",
+    "gazetteer_lookups_total": "Geocodes looked up in the local gazetteer, by result (hit/pending_hit/miss).",
+    "gazetteer_learned_total": "Places learned from Google geocodes into the local gazetteer.",
+    "route_sessions": "Route editing sessions held in memory.",
+    "route_sessions_evicted_total": "Route editing sessions dropped to stay under ROUTE_SESSION_MAX.",
+    "traces_recorded_total": "Route computations written to the trace file (TRACE_PATH).",
+    "memory_profiles_total": "Requests memory-profiled (MEMORY_PROFILE=1), by endpoint.",
+    "stage_memory_peak_bytes": "Peak traced allocations of each pipeline stage in memory-profiled requests.",
+    "request_memory_peak_bytes": "Peak traced allocations of memory-profiled requests, by endpoint.",
+}
+
+_lock = threading.Lock()
+_summaries = {}   # (name, labels) -> _Summary
+_counters = {}    # (name, labels) -> float
+_gauges = {}      # (name, labels) -> float
+_types = {}       # name -> "summary" | "counter" | "gauge"
+_stage_listeners = []
+
+
+class _Summary:
+    """Cumulative sum/count plus a bounded window of recent samples for quantiles."""
+
+    def __init__(self):
+        self.samples = deque(maxlen=WINDOW_SIZE)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.total += value
+        self.count += 1
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def observe(name, value, **labels):
+    """Record one observation (seconds) in the summary `name`."""
+    key = (name, _labels_key(labels))
+    with _lock:
+        _types.setdefault(name, "summary")
+        summary = _summaries.get(key)
+        if summary is None:
+            summary = _summaries[key] = _Summary()
+        summary.observe(value)
+
+
+def inc(name, amount=1, **labels):
+    """Increment the counter `name`."""
+    key = (name, _labels_key(labels))
+    with _lock:
+        _types.setdefault(name, "counter")
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """Set the gauge `name` to `value`."""
+    key = (name, _labels_key(labels))
+    with _lock:
+        _types.setdefault(name, "gauge")
+        _gauges[key] = value
+
+
+def add_stage_listener(fn):
+    """Register fn(stage, event, elapsed_sec) called on 'start' (elapsed None) and 'end' of every stage."""
+    _stage_listeners.append(fn)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time a pipeline stage. Exceptions are counted in stage_errors_total and re-raised."""
+    for fn in _stage_listeners:
+        fn(stage, "start", None)
+    t = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("stage_errors_total", stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - t
+        observe("stage_duration_seconds", elapsed, stage=stage)
+        for fn in _stage_listeners:
+            fn(stage, "end", elapsed)
+
+
+def count_request(endpoint, elapsed_sec, status_code):
+    """Record one handled request: count, duration, and error if status >= 400."""
+    inc("requests_total", endpoint=endpoint)
+    observe("request_duration_seconds", elapsed_sec, endpoint=endpoint)
+    if status_code >= 400:
+        inc("request_errors_total", endpoint=endpoint, status=str(status_code))
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    inner = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + inner + "}"
+
+
+def _format_value(value):
+    if value != value:
+        return "NaN"
+    return repr(float(value))
+
+
+def render_prometheus():
+    """Return all metrics in Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        summaries = [(name, labels, list(s.samples), s.total, s.count) for (name, labels), s in _summaries.items()]
+        counters = list(_counters.items())
+        gauges = list(_gauges.items())
+        types = dict(_types)
+
+    by_name = {}  # name -> [(labels, [lines])]
+    for name, labels, samples, total, count in summaries:
+        full = f"{PREFIX}_{name}"
+        lines = []
+        by_name.setdefault(name, []).append((labels, lines))
+        if samples:
+            qs = np.quantile(np.asarray(samples, dtype=np.float64), QUANTILES)
+        else:
+            qs = [float("nan")] * len(QUANTILES)
+        for q, v in zip(QUANTILES, qs):
+            lines.append(f"{full}{_format_labels(labels, [('quantile', q)])} {_format_value(v)}")
+        lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{full}_count{_format_labels(labels)} {count}")
+    for (name, labels), value in counters + gauges:
+        line = f"{PREFIX}_{name}{_format_labels(labels)} {_format_value(value)}"
+        by_name.setdefault(name, []).append((labels, [line]))
+
+    out = []
+    for name in sorted(by_name):
+        full = f"{PREFIX}_{name}"
+        out.append(f"# HELP {full} {HELP.get(name, name)}")
+        out.append(f"# TYPE {full} {types[name]}")
+        for _, lines in sorted(by_name[name], key=lambda item: item[0]):
+            out.extend(lines)
+    return "\n".join(out) + "\n"
@@ -0,0 +1,221 @@
+# raster_registry.py
+"""
+Registry of several UTCI rasters (cities, high-resolution campus insets) loaded from a manifest.
+
+Manifest (JSON; relative paths are resolved against the manifest's directory):
+
+    {"rasters": [
+        {"id": "austin", "path": "UTCI_1600.npz"},
+        {"id": "ut_campus", "path": "utci_campus_50cm.tif", "priority": 10},
+        {"id": "houston", "path": "utci_houston.npz", "crs": "EPSG:6344"}
+    ]}
+
+Bounds, CRS and resolution are read from each file's metadata at startup (only the headers; the
+bands are loaded lazily through raster_store.load_raster, which keeps a small LRU of resident
+rasters). "crs" is only needed for .npz files that do not store one.
+
+Each point is sampled from the best raster that has data there: highest "priority" first
+(default 0), then finest resolution, falling back to coarser layers where a finer one has no
+coverage or nodata. Candidate rasters come from a lon/lat grid index, so lookups stay cheap
+however many rasters are registered. Points outside every raster are read, edge-clamped, from the
+nearest one (as the single-raster path clamps to its edge).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import zipfile
+
+import numpy as np
+from pyproj import Transformer
+
+from raster_store import DEFAULT_CRS, load_raster, raster_version
+from sampling import sample_points
+
+# Grid index cell size in degrees (about 5 km)
+GRID_DEG = 0.05
+
+
+class RasterEntry:
+    """Manifest entry plus the metadata needed to index it (no band data)."""
+
+    def __init__(self, raster_id, path, priority, crs, bounds, resolution):
+        self.id = raster_id
+        self.path = path
+        self.priority = priority
+        self.crs = crs
+        self.bounds = bounds  # (left, bottom, right, top) in crs
+        self.resolution = resolution
+        self.lonlat_bounds = Transformer.from_crs(crs, "EPSG:4326", always_xy=True).transform_bounds(*bounds)
+
+    def load(self):
+        return load_raster(self.path, default_crs=self.crs)
+
+
+def _describe(path, crs=None):
+    """(crs, bounds, resolution) from a raster's header without reading its band."""
+    from rasterio.transform import Affine
+
+    if path.lower().endswith(".npz"):
+        data = np.load(path, allow_pickle=False)
+        transform = Affine(*data["transform"].tolist()[:6])
+        if "crs" in data:
+            crs = str(data["crs"])
+        with zipfile.ZipFile(path) as zf, zf.open("values.npy") as f:
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape = np.lib.format.read_array_header_1_0(f)[0]
+            else:
+                shape = np.lib.format.read_array_header_2_0(f)[0]
+    else:
+        import rasterio
+        with rasterio.open(path) as src:
+            transform = src.transform
+            shape = src.shape
+            if src.crs:
+                crs = src.crs.to_string()
+    h, w = shape[0], shape[1]
+    x0, y0 = transform * (0, 0)
+    x1, y1 = transform * (w, h)
+    bounds = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+    return crs or DEFAULT_CRS, bounds, abs(transform.a)
+
+
+class RasterRegistry:
+    def __init__(self, entries):
+        if not entries:
+            raise ValueError("Raster manifest lists no rasters")
+        # Preference order: priority, then finest resolution
+        self.entries = sorted(entries, key=lambda e: (-e.priority, e.resolution))
+        self.ids = [e.id for e in self.entries]
+        if len(set(self.ids)) != len(self.ids):
+            raise ValueError("Raster ids in the manifest must be unique")
+        # Widest layer: stands for the registry where one raster is needed (tiles)
+        self.base = max(range(len(self.entries)), key=lambda i: (self._area(self.entries[i]), -i))
+        self._grid = {}
+        for i, entry in enumerate(self.entries):
+            west, south, east, north = entry.lonlat_bounds
+            for gx in range(int(np.floor(west / GRID_DEG)), int(np.floor(east / GRID_DEG)) + 1):
+                for gy in range(int(np.floor(south / GRID_DEG)), int(np.floor(north / GRID_DEG)) + 1):
+                    self._grid.setdefault((gx, gy), []).append(i)
+        self._local = threading.local()
+
+    @classmethod
+    def from_manifest(cls, manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        entries = []
+        for item in manifest["rasters"]:
+            path = os.path.join(base_dir, item["path"])
+            crs, bounds, resolution = _describe(path, item.get("crs"))
+            entries.append(RasterEntry(item["id"], path, int(item.get("priority", 0)), crs, bounds, resolution))
+        registry = cls(entries)
+        for entry in registry.entries:
+            print(f"✓ Raster {entry.id}: {os.path.basename(entry.path)} {entry.crs} "
+                  f"{entry.resolution:g} m priority={entry.priority}", flush=True)
+        return registry
+
+    def version(self):
+        """Combined content version of every registered raster (for cache keys)."""
+        raw = "|".join(f"{e.id}={raster_version(e.path)}" for e in self.entries)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def base_path(self):
+        """Path of the layer with the widest coverage (used where one raster must stand for the registry, e.g. tiles)."""
+        return self.entries[self.base].path
+
+    @staticmethod
+    def _area(entry):
+        west, south, east, north = entry.lonlat_bounds
+        return (east - west) * (north - south)
+
+    def _nearest(self, lat, lon):
+        """Index of the raster whose bounds are closest to the points' centre."""
+        clat, clon = float(np.mean(lat)), float(np.mean(lon))
+
+        def distance(i):
+            west, south, east, north = self.entries[i].lonlat_bounds
+            return np.hypot(max(west - clon, 0, clon - east), max(south - clat, 0, clat - north))
+        return min(range(len(self.entries)), key=lambda i: (distance(i), i))
+
+    def _project(self, entry, lat, lon):
+        # pyproj transformers are not shared across threads
+        cache = getattr(self._local, "transformers", None)
+        if cache is None:
+            cache = self._local.transformers = {}
+        transformer = cache.get(entry.crs)
+        if transformer is None:
+            transformer = cache[entry.crs] = Transformer.from_crs("EPSG:4326", entry.crs, always_xy=True)
+        x, y = transformer.transform(lon, lat)
+        return np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+    @staticmethod
+    def _in_bounds(entry, lat, lon):
+        west, south, east, north = entry.lonlat_bounds
+        return (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+
+    def _candidates(self, lat, lon):
+        """Registry indices whose grid cells contain any of the points, in preference order."""
+        keys = set(zip(np.floor(lon / GRID_DEG).astype(int).tolist(), np.floor(lat / GRID_DEG).astype(int).tolist()))
+        found = set()
+        for key in keys:
+            found.update(self._grid.get(key, ()))
+        return sorted(found)
+
+    def sample(self, coords, mode="floor", corridor_m=None):
+        """
+        UTCI for (lat, lon) points, each from the preferred raster with data there.
+
+        :return: (values, raster index per point into self.ids)
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        lat, lon = coords[:, 0], coords[:, 1]
+        values = np.full(len(coords), np.nan)
+        served = np.full(len(coords), -1, dtype=np.intp)
+        for i in self._candidates(lat, lon):
+            todo = np.flatnonzero(served < 0)
+            if not len(todo):
+                break
+            entry = self.entries[i]
+            near = todo[self._in_bounds(entry, lat[todo], lon[todo])]
+            if not len(near):
+                continue
+            raster = entry.load()
+            x, y = self._project(entry, lat[near], lon[near])
+            hit = raster.covers(x, y)
+            if hit.any():
+                values[near[hit]] = sample_points(raster, x[hit], y[hit], mode, corridor_m)
+                served[near[hit]] = i
+
+        missing = np.flatnonzero(served < 0)
+        if len(missing):
+            nearest = self._nearest(lat[missing], lon[missing])
+            entry = self.entries[nearest]
+            x, y = self._project(entry, lat[missing], lon[missing])
+            values[missing] = sample_points(entry.load(), x, y, mode, corridor_m)
+            served[missing] = nearest
+        return values, served
+
+    def raster_for_route(self, coords):
+        """
+        (index, Raster) of the preferred raster covering every vertex of a route, else the one
+        covering the most vertices (exact scoring reads a whole route from one raster).
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        lat, lon = coords[:, 0], coords[:, 1]
+        best, best_count = None, 0
+        for i in self._candidates(lat, lon):
+            entry = self.entries[i]
+            near = self._in_bounds(entry, lat, lon)
+            if not near.any() or np.count_nonzero(near) <= best_count:
+                continue
+            x, y = self._project(entry, lat[near], lon[near])
+            count = int(np.count_nonzero(entry.load().covers(x, y)))
+            if count == len(coords):
+                return i, entry.load()
+            if count > best_count:
+                best, best_count = i, count
+        if best is None:
+            best = self._nearest(lat, lon)
+        return best, self.entries[best].load()
@@ -0,0 +1,224 @@
+# raster_store.py
+"""
+Raster bookkeeping shared by the backend: content-hash versions of UTCI raster files and
+process-wide resident copies of them.
+
+The version changes whenever the file's bytes change, so anything derived from a raster
+(cached route results, rendered tiles) can be keyed on it and invalidates itself when a new
+raster is downloaded or converted.
+"""
+
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+_version_lock = threading.Lock()
+_versions = {}  # path -> ((size, mtime_ns), version)
+
+
+def raster_version(path):
+    """Short content hash of the raster file, recomputed only when its size or mtime changes."""
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    with _version_lock:
+        cached = _versions.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    version = digest.hexdigest()[:16]
+    with _version_lock:
+        _versions[path] = (stamp, version)
+    return version
+
+
+# CRS of the UTCI rasters (.npz files carry no CRS of their own)
+DEFAULT_CRS = "EPSG:6343"
+MAX_OVERVIEW_LEVELS = 10
+# Resident rasters kept in memory at once (least recently used are dropped)
+MAX_RESIDENT_RASTERS = int(os.environ.get("RASTER_CACHE_SIZE", "4"))
+
+_raster_lock = threading.Lock()
+_rasters = OrderedDict()  # path -> Raster, least recently used first
+
+
+class Raster:
+    """
+    A UTCI raster held in memory, plus a lazily built overview pyramid.
+
+    values keeps the stored dtype (int16 for .npz, divided by `scale` when read) so the resident
+    copy is no larger than the file's band. Overview level k is a 2**k mean-decimated float32
+    array in °C, with NaN where the source had no data.
+    """
+
+    def __init__(self, path, values, transform, crs, version, scale=1.0, nodata=None):
+        self.path = path
+        self.values = values
+        self.transform = transform
+        self.crs = crs
+        self.version = version
+        self.scale = scale
+        self.nodata = nodata
+        self.shape = values.shape
+        self.res = abs(transform.a)
+        self._overviews = None
+        self._derived_lock = threading.Lock()
+        self._summed_area = None
+
+    @property
+    def bounds(self):
+        """(left, bottom, right, top) in the raster CRS."""
+        h, w = self.shape
+        x0, y0 = self.transform * (0, 0)
+        x1, y1 = self.transform * (w, h)
+        return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+    def to_celsius(self, raw):
+        """Convert stored values to float UTCI, NaN where nodata."""
+        out = raw.astype(np.float32)
+        if self.nodata is not None:
+            out[raw == self.nodata] = np.nan
+        if self.scale != 1.0:
+            out /= self.scale
+        return out
+
+    def overviews(self):
+        """[level1, level2, ...] float32 pyramids, built once on first use."""
+        with self._derived_lock:
+            if self._overviews is None:
+                levels = []
+                current = self.to_celsius(self.values)
+                for _ in range(MAX_OVERVIEW_LEVELS):
+                    h, w = current.shape[0] // 2, current.shape[1] // 2
+                    if h < 1 or w < 1:
+                        break
+                    block = current[:h * 2, :w * 2].reshape(h, 2, w, 2)
+                    valid = ~np.isnan(block)
+                    sums = np.where(valid, block, 0).sum(axis=(1, 3))
+                    counts = valid.sum(axis=(1, 3))
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        current = (sums / counts).astype(np.float32)
+                    levels.append(current)
+                self._overviews = levels
+            return self._overviews
+
+    def summed_area(self):
+        """
+        (sat, count_sat) integral images, built once on first use.
+
+        sat[r, c] is the sum of valid stored values over rows < r and cols < c, so any rectangle's
+        sum takes four lookups; count_sat counts valid cells the same way. Cells equal to the
+        nodata value and, in float rasters, NaN cells are invalid. Integer rasters use an exact
+        int64 table. count_sat is None when every cell can be valid (integer raster without a
+        nodata value): a rectangle's count is then its area.
+        """
+        with self._derived_lock:
+            if self._summed_area is None:
+                h, w = self.shape
+                integer = np.issubdtype(self.values.dtype, np.integer)
+                sat = np.zeros((h + 1, w + 1), dtype=np.int64 if integer else np.float64)
+                if integer and self.nodata is None:
+                    np.cumsum(np.cumsum(self.values, axis=0, dtype=sat.dtype), axis=1,
+                              dtype=sat.dtype, out=sat[1:, 1:])
+                    self._summed_area = (sat, None)
+                    return self._summed_area
+                valid = np.ones(self.shape, dtype=bool) if integer else ~np.isnan(self.values)
+                if self.nodata is not None:
+                    valid &= self.values != self.nodata
+                np.cumsum(np.cumsum(np.where(valid, self.values, 0), axis=0, dtype=sat.dtype), axis=1,
+                          dtype=sat.dtype, out=sat[1:, 1:])
+                count_sat = np.zeros((h + 1, w + 1), dtype=np.int64)
+                np.cumsum(np.cumsum(valid, axis=0, dtype=np.int64), axis=1, out=count_sat[1:, 1:])
+                self._summed_area = (sat, count_sat)
+            return self._summed_area
+
+    def covers(self, x, y):
+        """Boolean mask of points (raster CRS) that fall on a cell with data."""
+        inv = ~self.transform
+        cols = np.floor(inv.a * x + inv.b * y + inv.c)
+        rows = np.floor(inv.d * x + inv.e * y + inv.f)
+        h, w = self.shape
+        mask = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+        raw = self.values[rows[mask].astype(np.intp), cols[mask].astype(np.intp)]
+        valid = np.ones(len(raw), dtype=bool)
+        if self.nodata is not None:
+            valid &= raw != self.nodata
+        if np.issubdtype(raw.dtype, np.floating):
+            valid &= ~np.isnan(raw)
+        mask[mask] = valid
+        return mask
+
+    def sample_level(self, level, rows, cols):
+        """
+        UTCI at level-0 (row, col) float indices, read from overview `level` (0 = full resolution).
+        Points outside the raster come back as NaN.
+        """
+        if level > 0:
+            arr = self.overviews()[level - 1]
+            r = np.floor(rows / 2 ** level).astype(np.intp)
+            c = np.floor(cols / 2 ** level).astype(np.intp)
+        else:
+            arr = self.values
+            r = np.floor(rows).astype(np.intp)
+            c = np.floor(cols).astype(np.intp)
+        h, w = arr.shape
+        inside = (r >= 0) & (r < h) & (c >= 0) & (c < w)
+        out = np.full(r.shape, np.nan, dtype=np.float32)
+        raw = arr[r[inside], c[inside]]
+        out[inside] = self.to_celsius(raw) if level == 0 else raw
+        return out
+
+
+def _read_raster(path, version, default_crs=DEFAULT_CRS):
+    from rasterio.transform import Affine
+    from layer_stack import is_stack, open_stack, NODATA
+
+    if is_stack(path):
+        # UTCI layer of a co-registered stack, still memory-mapped
+        stack = open_stack(path)
+        i = stack.layers.index("utci")
+        return Raster(path, stack.stack[i], stack.transform, stack.crs, version, scale=float(stack.scales[i]),
+                      nodata=NODATA)
+
+    if path.lower().endswith(".npz"):
+        data = np.load(path, allow_pickle=False)
+        values = data["values"]
+        transform = Affine(*data["transform"].tolist()[:6])
+        scale = float(data["scale"]) if "scale" in data else 1.0
+        crs = str(data["crs"]) if "crs" in data else default_crs
+        return Raster(path, values, transform, crs, version, scale=scale)
+
+    import rasterio
+    with rasterio.open(path) as src:
+        values = src.read(1)
+        crs = src.crs.to_string() if src.crs else default_crs
+        return Raster(path, values, src.transform, crs, version, nodata=src.nodata)
+
+
+def load_raster(path, default_crs=DEFAULT_CRS):
+    """
+    Process-wide resident Raster for path, reloaded when the file's content version changes.
+
+    At most MAX_RESIDENT_RASTERS stay loaded; the least recently used is dropped first.
+    default_crs applies to files that carry no CRS.
+    """
+    version = raster_version(path)
+    with _raster_lock:
+        raster = _rasters.get(path)
+        if raster is not None and raster.version == version:
+            _rasters.move_to_end(path)
+            return raster
+        raster = _read_raster(path, version, default_crs)
+        _rasters[path] = raster
+        _rasters.move_to_end(path)
+        while len(_rasters) > max(MAX_RESIDENT_RASTERS, 1):
+            evicted, _ = _rasters.popitem(last=False)
+            print(f"Evicted resident raster {os.path.basename(evicted)}", flush=True)
+    print(f"Loaded resident raster {os.path.basename(path)} {raster.shape} version={version}", flush=True)
+    return raster
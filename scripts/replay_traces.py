@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Replay recorded route traces (see trace_recorder.py) through the scoring pipeline, offline.
+
+Each trace carries the geocodes and directions the pipeline consumed when it was recorded, so
+replay needs no network or API key: those answers are fed back in and any outbound HTTP call
+fails. Traces are replayed in parallel worker processes (--workers, default one per core), each
+with its own output directory and resident raster. Timings under parallel load are noisier; use
+--workers 1 for the most precise per-stage numbers.
+
+A run reports per-stage median times and, per trace, the route statistics
+([mean, min, max, shade %] per route) and the response body hash. By default it is diffed
+against what was recorded; --compare diffs against a saved run instead, e.g. one from an older
+checkout or another raster encoding. Recorded geocode/directions times are left out, since
+replay does not call Google.
+
+Usage:
+  python replay_traces.py output/traces.jsonl.gz                       # vs the recorded results and timings
+  python replay_traces.py output/traces.jsonl.gz --raster UTCI_1600.tif --save run_tif.json
+  python replay_traces.py output/traces.jsonl.gz --raster UTCI_1600.npz --compare run_tif.json
+  python replay_traces.py --diff run_before.json run_after.json --time-tolerance 0.2
+
+Exits with status 1 if any trace's statistics differ by more than --tolerance (or it fails only
+on one side), or, with --time-tolerance, if a stage's median time regressed by more than that fraction.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from trace_recorder import read_traces
+
+# Stages that talk to Google: recorded, but never run on replay
+EXTERNAL_STAGES = ("geocode", "directions")
+
+_backend = None
+
+
+def _no_network(*args, **kwargs):
+    raise RuntimeError("Network access during trace replay")
+
+
+def _init_worker(raster_path, verbose):
+    global _backend
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    os.environ["TRACE_PATH"] = ""
+    import requests
+    requests.get = requests.post = _no_network
+    import backend
+    backend.OUTPUT_DIR = tempfile.mkdtemp(prefix="replay_")
+    if raster_path:
+        from raster_store import load_raster
+        load_raster(raster_path)
+    _backend = backend
+
+
+def _replay_one(task):
+    """Re-run one trace; returns {"index", "stages", "total_s", "result" or "error"}."""
+    import trace_recorder
+
+    index, trace, raster_path = task
+    geocodes = [tuple(latlon) for latlon in trace["geocode"]]
+    _backend.get_lat_lon_from_addresses = lambda addresses, api_key: geocodes
+    _backend.get_directions_polylines = lambda *args, **kwargs: trace["directions"]
+    replayed = {"index": index}
+    try:
+        with trace_recorder.tracing(replayed):
+            if trace["endpoint"] == "process_route_stream":
+                for _ in _backend.stream_route_response(trace["origin"], trace["destination"], trace["options"],
+                                                        raster_path):
+                    pass
+            else:
+                _backend.compute_route_response(trace["origin"], trace["destination"], trace["options"], raster_path)
+    except Exception:
+        pass
+    # The answers fed in above are in the trace already
+    replayed.pop("geocode", None)
+    replayed.pop("directions", None)
+    return replayed
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def replay(traces, raster_path, workers, verbose=False):
+    """Replay (index, trace) pairs; returns a run dict as saved by --save."""
+    tasks = [(index, trace, raster_path) for index, trace in traces]
+    start = time.perf_counter()
+    if workers <= 1:
+        _init_worker(raster_path, True)
+        results = [_replay_one(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers, _init_worker, (raster_path, verbose)) as pool:
+            results = list(pool.imap(_replay_one, tasks, chunksize=1))
+    by_index = {index: trace for index, trace in traces}
+    for result in results:
+        trace = by_index[result["index"]]
+        result["origin"], result["destination"] = trace["origin"], trace["destination"]
+    return {
+        "label": f"replay {_git_revision() or ''} {os.path.basename(raster_path) if raster_path else 'registry'}".strip(),
+        "revision": _git_revision(),
+        "raster": raster_path,
+        "workers": workers,
+        "wall_s": time.perf_counter() - start,
+        "traces": results,
+    }
+
+
+def recorded_run(traces):
+    """The recording itself, in run format (for diffing a replay against production)."""
+    return {
+        "label": "recorded",
+        "traces": [{"index": index, "origin": t["origin"], "destination": t["destination"],
+                    "stages": t.get("stages", {}), "result": t.get("result"), "error": t.get("error")}
+                   for index, t in traces],
+    }
+
+
+def stage_medians(run):
+    """Median seconds per stage (and scoring total, without external stages) over traces that succeeded."""
+    samples = {}
+    for trace in run["traces"]:
+        if trace.get("error"):
+            continue
+        stages = {k: v for k, v in trace.get("stages", {}).items() if k not in EXTERNAL_STAGES}
+        for stage, seconds in stages.items():
+            samples.setdefault(stage, []).append(seconds)
+        samples.setdefault("total (scoring)", []).append(sum(stages.values()))
+    return {stage: float(np.median(values)) for stage, values in samples.items()}
+
+
+def _max_stat_diff(a, b):
+    if a is None or b is None or len(a["routes"]) != len(b["routes"]):
+        return float("inf")
+    if not a["routes"]:
+        return 0.0
+    return float(np.max(np.abs(np.array(a["routes"], dtype=float) - np.array(b["routes"], dtype=float))))
+
+
+def diff_runs(a, b, tolerance, time_tolerance=None):
+    """Print result and timing differences between two runs; returns True if within tolerances."""
+    ok = True
+    print(f"A: {a.get('label', 'A')}    B: {b.get('label', 'B')}")
+
+    b_traces = {t["index"]: t for t in b["traces"]}
+    identical = within = 0
+    mismatches = []
+    for ta in a["traces"]:
+        tb = b_traces.get(ta["index"])
+        if tb is None:
+            continue
+        if ta.get("error") or tb.get("error"):
+            if bool(ta.get("error")) != bool(tb.get("error")):
+                mismatches.append((ta, f"error A={ta.get('error')} B={tb.get('error')}"))
+            continue
+        ra, rb = ta.get("result"), tb.get("result")
+        if ra and rb and ra.get("sha1") and ra.get("sha1") == rb.get("sha1"):
+            identical += 1
+            continue
+        diff = _max_stat_diff(ra, rb)
+        if diff <= tolerance:
+            within += 1
+        else:
+            mismatches.append((ta, f"max statistic difference {diff:.6g}"))
+    compared = sum(1 for t in a["traces"] if t["index"] in b_traces)
+    print(f"\nResults ({compared} traces): {identical} identical responses, {within} statistics within "
+          f"{tolerance:g}, {len(mismatches)} different")
+    for trace, reason in mismatches[:20]:
+        print(f"  #{trace['index']} {trace['origin']} -> {trace['destination']}: {reason}")
+    if mismatches:
+        ok = False
+
+    ma, mb = stage_medians(a), stage_medians(b)
+    print(f"\n{'stage':<18} {'A median ms':>12} {'B median ms':>12} {'change':>8}")
+    for stage in sorted(set(ma) & set(mb), key=lambda s: (s.startswith("total"), s)):
+        change = (mb[stage] - ma[stage]) / ma[stage] if ma[stage] > 0 else 0.0
+        flag = ""
+        if time_tolerance is not None and change > time_tolerance and not stage.startswith("total"):
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{stage:<18} {ma[stage] * 1000:>12.2f} {mb[stage] * 1000:>12.2f} {change:>+8.1%}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded route traces offline and diff the results.")
+    parser.add_argument("trace_file", nargs="?", help="Trace file written with TRACE_PATH")
+    parser.add_argument("--raster", help="Raster to score against (default: the backend's active raster)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--limit", type=int, help="Replay only the first N traces")
+    parser.add_argument("--save", metavar="PATH", help="Write the replay run as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="Diff against a saved run instead of the recording")
+    parser.add_argument("--diff", nargs=2, metavar=("A", "B"), help="Diff two saved runs (no replay)")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="Allowed absolute difference in statistics")
+    parser.add_argument("--time-tolerance", type=float, help="Fail if a stage median is this fraction slower")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline output from worker processes")
+    args = parser.parse_args()
+
+    if args.diff:
+        runs = []
+        for path in args.diff:
+            with open(path) as f:
+                runs.append(json.load(f))
+        sys.exit(0 if diff_runs(runs[0], runs[1], args.tolerance, args.time_tolerance) else 1)
+    if not args.trace_file:
+        parser.error("a trace file (or --diff A B) is required")
+
+    traces = [(index, trace) for index, trace in enumerate(read_traces(args.trace_file))
+              if trace.get("geocode") and trace.get("directions")]
+    if args.limit:
+        traces = traces[:args.limit]
+    if not traces:
+        print(f"No replayable traces in {args.trace_file}")
+        sys.exit(1)
+
+    raster_path = args.raster
+    if raster_path is None:
+        import backend
+        raster_path = backend.current_raster()[0]
+    if raster_path:
+        raster_path = os.path.abspath(raster_path)
+    print(f"Replaying {len(traces)} traces against {raster_path or 'the raster registry'} "
+          f"with {args.workers} worker(s)...", flush=True)
+    run = replay(traces, raster_path, args.workers, args.verbose)
+    failed = sum(1 for t in run["traces"] if t.get("error"))
+    print(f"Replayed in {run['wall_s']:.2f} s ({failed} failed)\n")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(run, f, indent=1)
+        print(f"Saved run to {args.save}\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    else:
+        baseline = recorded_run(traces)
+    sys.exit(0 if diff_runs(baseline, run, args.tolerance, args.time_tolerance) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# result_cache.py
+"""
+Byte-bounded LRU cache of serialized responses (/api/process-route results, rendered tiles).
+
+Keys combine the normalized origin/destination, the response options and the raster content
+version (raster_store.raster_version), so a new raster never serves stale results; set_version()
+also drops entries from older rasters to free their memory straight away.
+
+With a shared backend (cache_backends.make_shared_cache, i.e. CACHE_URL set), stored responses are
+also written there and local misses are looked up there, so instances serve each other's results.
+Shared copies are packed with pack_entry: JSON bodies (UTCI sample arrays as text) are
+zlib-compressed, while the compact and binary formats already hold typed arrays.
+"""
+
+import hashlib
+import json
+import struct
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+
+from cache_backends import pack_strings, unpack_strings
+from metrics import inc, set_gauge
+
+CacheEntry = namedtuple("CacheEntry", ["body", "mimetype", "etag", "version"])
+
+
+def normalize_place(text):
+    """Case- and whitespace-insensitive form of a user-typed place name."""
+    return " ".join(str(text).lower().split()).strip(" ,.")
+
+
+def route_cache_key(origin, destination, options, version):
+    """Stable key for one response: places, response options and raster version."""
+    raw = json.dumps([normalize_place(origin), normalize_place(destination), options, version],
+                     sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def make_etag(body):
+    """Strong validator for a response body (unquoted; Response.set_etag adds the quotes)."""
+    return hashlib.sha1(body).hexdigest()[:20]
+
+
+def pack_entry(entry):
+    """Bytes for a shared cache: flag, body length, body (zlib-compressed when that saves space), then strings."""
+    body = entry.body
+    packed = zlib.compress(body, 6)
+    compressed = len(packed) < len(body) * 0.9
+    if compressed:
+        body = packed
+    return (struct.pack('<?I', compressed, len(body)) + body +
+            pack_strings(entry.mimetype, entry.etag, json.dumps(entry.version)))
+
+
+def unpack_entry(data):
+    compressed, size = struct.unpack_from('<?I', data)
+    offset = struct.calcsize('<?I')
+    body = data[offset:offset + size]
+    mimetype, etag, version = unpack_strings(data, offset + size)
+    return CacheEntry(zlib.decompress(body) if compressed else body, mimetype, etag, json.loads(version))
+
+
+class ResultCache:
+    """Thread-safe LRU of CacheEntry values, evicting least-recently-used entries beyond max_bytes."""
+
+    def __init__(self, max_bytes, name="result_cache", shared=None, shared_ttl=None):
+        """
+        :param max_bytes: In-process size bound
+        :param name: Metrics prefix
+        :param shared: Optional cache backend shared with other instances (cache_backends)
+        :param shared_ttl: Seconds entries live in the shared backend (None: until it evicts them)
+        """
+        self.max_bytes = max_bytes
+        self.name = name
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key, count_miss=True):
+        """Cached entry for key or None; count_miss=False for a re-check already counted as a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        result = "hit"
+        if entry is None and self.shared is not None:
+            data = self.shared.get(key)
+            entry = self._unpack(data) if data is not None else None
+            if entry is not None:
+                result = "shared_hit"
+                self._store(key, entry)
+        if entry is not None or count_miss:
+            inc(f"{self.name}_requests_total", result=result if entry is not None else "miss")
+        return entry
+
+    def _unpack(self, data):
+        try:
+            entry = unpack_entry(data)
+        except (struct.error, ValueError, zlib.error, UnicodeDecodeError):
+            return None
+        # Keys include the version already; this only guards against foreign or corrupt entries
+        return entry if self._version is None or entry.version == self._version else None
+
+    def put(self, key, body, mimetype, version):
+        """Store a response body and return its entry (with ETag). Oversized bodies are not stored."""
+        entry = CacheEntry(body, mimetype, make_etag(body), version)
+        if self.shared is not None:
+            self.shared.set(key, pack_entry(entry), self.shared_ttl)
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        body = entry.body
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            evicted = 0
+            while self._bytes > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self._bytes -= len(dropped.body)
+                evicted += 1
+            self._update_gauges()
+        if evicted:
+            inc(f"{self.name}_evictions_total", evicted)
+
+    def set_version(self, version):
+        """Drop every entry computed from a different raster version."""
+        with self._lock:
+            if version == self._version:
+                return
+            self._version = version
+            stale = [k for k, e in self._entries.items() if e.version != version]
+            for k in stale:
+                self._bytes -= len(self._entries.pop(k).body)
+            self._update_gauges()
+        if stale:
+            print(f"{self.name}: raster changed (version {version}), dropped {len(stale)} entries", flush=True)
+
+    def _update_gauges(self):
+        set_gauge(f"{self.name}_bytes", self._bytes)
+        set_gauge(f"{self.name}_entries", len(self._entries))
@@ -0,0 +1,194 @@
+# route_encoding.py
+"""
+Compact encodings for /api/process-route payloads, selected by content negotiation.
+
+Formats (Accept header, or "format" in the request body):
+  json     application/json                          Default; coordinates as [lat, lng] lists.
+  compact  application/vnd.coolroute.compact+json    Small JSON; per-route samples as base64 typed arrays.
+  binary   application/vnd.coolroute.binary          Length-prefixed binary; no base64 overhead.
+
+Typed arrays (both compact and binary, little-endian):
+  coordinates  int32[2n]  lat0, lng0, dlat1, dlng1, ...  in 1e-6 degrees (prefix-sum to decode)
+  utci_values  int16[n]   UTCI * 100 (0.01 °C, same quantization as the .npz raster);
+                          -32768 marks a missing (NaN) sample, finite values are clipped to +-327.67
+
+Binary layout:
+  b"CRB1" | uint32 meta_len | meta JSON (utf-8), zero-padded to a 4-byte boundary
+  then for each route: int32[2n] coordinates, int16[n] utci_values (if present), zero-padded to 4 bytes
+Meta JSON is the compact payload without the base64 array strings, so each route's "n" and
+"has_utci_values" give the array lengths. Every array starts 4-byte aligned, so the browser can
+wrap it with `new Int32Array(buffer, offset, 2 * n)` / `new Int16Array(buffer, offset, n)` without copying.
+"""
+
+import base64
+import json
+import struct
+
+import numpy as np
+
+from scoring import route_summary, response_envelope, raster_runs
+
+FORMAT_JSON = 'json'
+FORMAT_COMPACT = 'compact'
+FORMAT_BINARY = 'binary'
+
+MIME_TYPES = {
+    FORMAT_JSON: 'application/json',
+    FORMAT_COMPACT: 'application/vnd.coolroute.compact+json',
+    FORMAT_BINARY: 'application/vnd.coolroute.binary',
+}
+
+COORDINATE_SCALE = 1e6
+UTCI_SCALE = 100
+# int16 value reserved for non-finite UTCI samples (decoded back to null)
+UTCI_MISSING = int(np.iinfo('<i2').min)
+BINARY_MAGIC = b"CRB1"
+
+
+def negotiate_format(accept_header, requested=None):
+    """Pick a response format from an explicit request field or the Accept header (default json)."""
+    if requested:
+        requested = str(requested).lower()
+        if requested not in MIME_TYPES:
+            raise ValueError(f"Unknown format '{requested}' (expected one of {', '.join(MIME_TYPES)})")
+        return requested
+    if accept_header:
+        # q-values are ignored: the first listed type we can produce wins
+        for part in accept_header.split(','):
+            mime = part.split(';')[0].strip().lower()
+            for fmt, fmt_mime in MIME_TYPES.items():
+                if mime == fmt_mime:
+                    return fmt
+    return FORMAT_JSON
+
+
+def parse_samples_option(samples):
+    """
+    Interpret the request's "samples" field.
+
+    :return: (samples, max_points): samples is 'full' or 'none'; max_points is None or a positive int
+    """
+    if samples is None or samples == 'full':
+        return 'full', None
+    if samples == 'none':
+        return 'none', None
+    try:
+        max_points = int(samples)
+    except (TypeError, ValueError):
+        raise ValueError("samples must be 'full', 'none' or a maximum number of points per route")
+    if max_points < 2:
+        raise ValueError("samples must be at least 2 points per route")
+    return 'full', max_points
+
+
+def coordinates_to_int32(coordinates):
+    """Delta-encode (lat, lng) pairs as interleaved int32 in 1e-6 degrees."""
+    q = np.round(np.asarray(coordinates, dtype=np.float64).reshape(-1, 2) * COORDINATE_SCALE).astype(np.int64)
+    deltas = np.empty_like(q)
+    if len(q):
+        deltas[0] = q[0]
+        deltas[1:] = np.diff(q, axis=0)
+    return deltas.astype('<i4').ravel()
+
+
+def utci_to_int16(values):
+    """Quantize UTCI to int16 hundredths of a degree; NaN/inf become UTCI_MISSING."""
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    scaled = np.clip(np.round(np.where(finite, values, 0.0) * UTCI_SCALE), UTCI_MISSING + 1, np.iinfo('<i2').max)
+    return np.where(finite, scaled, UTCI_MISSING).astype('<i2')
+
+
+def utci_from_int16(utci):
+    """Inverse of utci_to_int16: UTCI values as a list, None where the sample was missing."""
+    utci = np.asarray(utci)
+    values = utci / UTCI_SCALE
+    return [None if missing else value for missing, value in zip((utci == UTCI_MISSING).tolist(), values.tolist())]
+
+
+def _route_arrays(route, values, samples, indices):
+    if indices is not None:
+        route = np.asarray(route, dtype=np.float64)[indices]
+        values = values[indices]
+    coords = coordinates_to_int32(route)
+    utci = utci_to_int16(values) if samples != 'none' else None
+    return coords, utci
+
+
+def _compact_meta(routes_meta, stats, origin, destination):
+    payload = response_envelope(routes_meta, stats, origin, destination)
+    payload['encoding'] = {
+        'coordinates': {'type': 'int32', 'delta': True, 'scale': COORDINATE_SCALE, 'order': 'lat,lng'},
+        'utci_values': {'type': 'int16', 'scale': UTCI_SCALE, 'missing': UTCI_MISSING},
+    }
+    return payload
+
+
+def build_compact_response(interpolated_routes, google_routes_data, stats, origin, destination,
+                           samples='full', point_indices=None):
+    """Compact JSON payload: route summaries as plain JSON, samples as base64 typed arrays."""
+    routes_meta = []
+    for i, route in enumerate(interpolated_routes):
+        indices = point_indices[i] if point_indices is not None else None
+        coords, utci = _route_arrays(route, stats['utci_values'][i], samples, indices)
+        meta = route_summary(stats, i, google_routes_data[i])
+        meta['n'] = len(coords) // 2
+        runs = raster_runs(stats, i, indices)
+        if runs is not None:
+            meta['raster_runs'] = runs
+        meta['coordinates'] = base64.b64encode(coords.tobytes()).decode('ascii')
+        if utci is not None:
+            meta['utci_values'] = base64.b64encode(utci.tobytes()).decode('ascii')
+        routes_meta.append(meta)
+    return _compact_meta(routes_meta, stats, origin, destination)
+
+
+def _pad4(buf):
+    return buf + b"\0" * (-len(buf) % 4)
+
+
+def build_binary_response(interpolated_routes, google_routes_data, stats, origin, destination,
+                          samples='full', point_indices=None):
+    """Length-prefixed binary payload (see module docstring for the layout)."""
+    routes_meta = []
+    chunks = []
+    for i, route in enumerate(interpolated_routes):
+        indices = point_indices[i] if point_indices is not None else None
+        coords, utci = _route_arrays(route, stats['utci_values'][i], samples, indices)
+        meta = route_summary(stats, i, google_routes_data[i])
+        meta['n'] = len(coords) // 2
+        meta['has_utci_values'] = utci is not None
+        runs = raster_runs(stats, i, indices)
+        if runs is not None:
+            meta['raster_runs'] = runs
+        routes_meta.append(meta)
+        chunk = coords.tobytes()
+        if utci is not None:
+            chunk += utci.tobytes()
+        chunks.append(_pad4(chunk))
+
+    meta_bytes = json.dumps(_compact_meta(routes_meta, stats, origin, destination),
+                            separators=(',', ':')).encode('utf-8')
+    header = BINARY_MAGIC + struct.pack('<I', len(meta_bytes))
+    return _pad4(header + meta_bytes) + b"".join(chunks)
+
+
+def decode_binary_response(body):
+    """Inverse of build_binary_response, for tools and debugging: returns the JSON-format payload."""
+    if body[:4] != BINARY_MAGIC:
+        raise ValueError("Not a route binary payload")
+    (meta_len,) = struct.unpack_from('<I', body, 4)
+    meta = json.loads(body[8:8 + meta_len].decode('utf-8'))
+    offset = 8 + meta_len
+    offset += -offset % 4
+    for route in meta['routes']:
+        n = route['n']
+        coords = np.frombuffer(body, dtype='<i4', count=2 * n, offset=offset)
+        offset += 8 * n
+        route['coordinates'] = (np.cumsum(coords.reshape(-1, 2).astype(np.int64), axis=0) / COORDINATE_SCALE).tolist()
+        if route.pop('has_utci_values'):
+            utci = np.frombuffer(body, dtype='<i2', count=n, offset=offset)
+            offset += 2 * n
+            route['utci_values'] = utci_from_int16(utci)
+        offset += -offset % 4
+    return meta
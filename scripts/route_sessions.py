@@ -0,0 +1,378 @@
+# route_sessions.py
+"""
+Route editing sessions: re-score one route after waypoint edits without calling Google again.
+
+A client submits a route (an encoded polyline or its vertices) once. The route is kept as leaves
+in a segment tree: the start vertex, one leaf per polyline segment (the 4 m points
+utils.interpolate_segment places strictly between its vertices) and the end vertex, the same
+points interpolate_geopath_equidistant returns. Each leaf holds partial aggregates (UTCI sum,
+count, min, max, shade sum, shade count), and every tree node holds those of its range.
+
+An edit (move a vertex, or replace the vertices between two others) re-interpolates and
+re-samples only the segments it touches. When the number of leaves is unchanged, the tree is
+updated in O(log n); a splice that adds or removes segments rebuilds the tree from the leaf
+aggregates already in hand (no resampling). Route statistics are read from the root.
+
+Shade is the share of samples below a fixed UTCI threshold (the session's, so percentages stay
+comparable across edits) or, with a layer stack, the mean measured shade fraction.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from pyproj import Transformer
+
+from layer_stack import is_stack, open_stack
+from metrics import inc, set_gauge
+from raster_store import load_raster
+from sampling import sample_points
+from scoring import SHADE_PERCENTILE
+from utils import decode_polyline, interpolate_segment
+
+# Same densification as /api/process-route
+POINT_SPACING_M = 4
+# Most vertices a session route may have (or gain through edits)
+MAX_VERTICES = 5000
+
+# Aggregate fields of a leaf / tree node
+SUM, COUNT, MIN, MAX, SHADE, SHADE_COUNT = range(6)
+EMPTY = np.array([0.0, 0.0, np.inf, -np.inf, 0.0, 0.0])
+
+
+def _combine(left, right):
+    """Aggregates of two adjacent ranges (works row-wise on (n, 6) arrays)."""
+    out = left + right
+    out[..., MIN] = np.minimum(left[..., MIN], right[..., MIN])
+    out[..., MAX] = np.maximum(left[..., MAX], right[..., MAX])
+    return out
+
+
+class SegmentTree:
+    """Bottom-up segment tree of leaf aggregates with O(log n) point updates and range queries."""
+
+    def __init__(self, leaves):
+        leaves = np.asarray(leaves, dtype=np.float64).reshape(-1, len(EMPTY))
+        self.n = len(leaves)
+        self.size = 1
+        while self.size < max(self.n, 1):
+            self.size *= 2
+        self.nodes = np.tile(EMPTY, (2 * self.size, 1))
+        self.nodes[self.size:self.size + self.n] = leaves
+        # One vectorized combine per level instead of one per node
+        lo = self.size
+        while lo > 1:
+            children = self.nodes[lo:2 * lo]
+            self.nodes[lo // 2:lo] = _combine(children[0::2], children[1::2])
+            lo //= 2
+
+    def update(self, i, leaf):
+        i += self.size
+        self.nodes[i] = leaf
+        i //= 2
+        while i >= 1:
+            self.nodes[i] = _combine(self.nodes[2 * i], self.nodes[2 * i + 1])
+            i //= 2
+
+    def query(self, lo, hi):
+        """Aggregates of leaves lo .. hi - 1."""
+        left, right = EMPTY.copy(), EMPTY.copy()
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                left = _combine(left, self.nodes[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                right = _combine(self.nodes[hi], right)
+            lo //= 2
+            hi //= 2
+        return _combine(left, right)
+
+    def total(self):
+        return self.nodes[1].copy()
+
+
+_local = threading.local()
+
+
+def _transformer(crs):
+    """Per-thread cached EPSG:4326 -> crs transformer."""
+    cache = getattr(_local, "transformers", None)
+    if cache is None:
+        cache = _local.transformers = {}
+    if crs not in cache:
+        cache[crs] = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+    return cache[crs]
+
+
+def make_sampler(raster_path=None, registry=None, sample_mode="floor", corridor_m=None):
+    """
+    Callable (lat, lon) points -> (UTCI, measured shade or None) reading the resident raster (or
+    the raster registry), as create_shapefiles_and_extract_raster_values does for whole routes.
+    """
+    def sample(points):
+        coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if registry is not None:
+            return registry.sample(coords, sample_mode, corridor_m)[0], None
+        raster = load_raster(raster_path)
+        x, y = _transformer(raster.crs).transform(coords[:, 1], coords[:, 0])
+        x, y = np.atleast_1d(x), np.atleast_1d(y)
+        shade = None
+        if is_stack(raster_path):
+            shade = open_stack(raster_path).sample(x, y).get('shade')
+        return sample_points(raster, x, y, sample_mode, corridor_m), shade
+    return sample
+
+
+def parse_vertices(data, field='coordinates'):
+    """(lat, lon) vertices from an encoded "polyline" or a [[lat, lon], ...] list in data[field]."""
+    if data.get('polyline'):
+        vertices = decode_polyline(str(data['polyline']))
+    else:
+        try:
+            vertices = [(float(p[0]), float(p[1])) for p in data.get(field) or []]
+        except (TypeError, ValueError, IndexError):
+            raise ValueError(f"{field} must be a list of [lat, lon] pairs")
+    for lat, lon in vertices:
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("Coordinates must be valid latitudes and longitudes")
+    return vertices
+
+
+class RouteSession:
+    def __init__(self, vertices, raster_path, version, registry=None, sample_mode="floor", corridor_m=None,
+                 shade_threshold=None):
+        """
+        :param vertices: (lat, lon) route vertices (at least 2)
+        :param raster_path: UTCI raster or layer stack (None with registry)
+        :param version: Content version of the raster(s), see backend.current_raster
+        :param registry: Optional raster_registry.RasterRegistry
+        :param sample_mode: One of sampling.SAMPLE_MODES, with corridor_m for corridor
+        :param shade_threshold: UTCI below which a sample counts as shade; default the route's
+            own bottom-SHADE_PERCENTILE threshold, as compute_route_statistics gives for one route
+        """
+        if not 2 <= len(vertices) <= MAX_VERTICES:
+            raise ValueError(f"A route needs between 2 and {MAX_VERTICES} vertices")
+        self.id = secrets.token_urlsafe(12)
+        self.lock = threading.Lock()
+        self.vertices = list(vertices)
+        self.registry = registry
+        self.sample_mode = sample_mode
+        self.corridor_m = corridor_m
+        self.shade_threshold = shade_threshold
+        self.edits = 0
+        self.touched = time.monotonic()
+        self.resample(raster_path, version)
+
+    @property
+    def utm_zone(self):
+        # Fixed by the first vertex, as in interpolate_geopath_equidistant
+        return int((self.vertices[0][1] + 180) / 6) + 1
+
+    def _leaf_points(self, k):
+        """Points of leaf k: start vertex, segment k - 1 interior, or end vertex."""
+        if k == 0:
+            return [self.vertices[0]]
+        if k == len(self.vertices):
+            return [self.vertices[-1]]
+        return interpolate_segment(self.vertices[k - 1], self.vertices[k], POINT_SPACING_M, self.utm_zone)
+
+    def _sample_leaves(self, ks):
+        """(points, utci, shade) per leaf in ks, sampled in one batch."""
+        points = [self._leaf_points(k) for k in ks]
+        flat = [p for pts in points for p in pts]
+        utci, shade = self.sampler(flat)
+        bounds = np.cumsum([0] + [len(pts) for pts in points])
+        return [(pts, utci[a:b], shade[a:b] if shade is not None else None)
+                for pts, a, b in zip(points, bounds[:-1], bounds[1:])]
+
+    def _aggregate(self, leaf):
+        _, utci, shade = leaf
+        if shade is not None:
+            valid = ~np.isnan(shade)
+            in_shade, shade_count = np.clip(shade[valid], 0.0, 1.0).sum(), np.count_nonzero(valid)
+        else:
+            in_shade, shade_count = np.count_nonzero(utci < self.shade_threshold), len(utci)
+        return np.array([utci.sum(), len(utci), utci.min(), utci.max(), in_shade, shade_count])
+
+    def resample(self, raster_path, version):
+        """Sample every leaf again (new session, or the raster changed underneath it)."""
+        self.sampler = make_sampler(raster_path, self.registry, self.sample_mode, self.corridor_m)
+        self.leaves = self._sample_leaves(range(len(self.vertices) + 1))
+        if self.shade_threshold is None:
+            values = np.concatenate([utci for _, utci, _ in self.leaves])
+            self.shade_threshold = float(values.min() + (values.max() - values.min()) * SHADE_PERCENTILE / 100)
+        # (n_leaves, 6) aggregates kept alongside self.leaves, so a splice only aggregates new leaves
+        self.aggregates = np.array([self._aggregate(leaf) for leaf in self.leaves])
+        self.tree = SegmentTree(self.aggregates)
+        self.version = version
+
+    def _span_leaves(self, first, last):
+        """Leaf range [lo, hi) holding the route's points from vertex first to vertex last."""
+        lo = 0 if first == 0 else first + 1
+        hi = len(self.vertices) + 1 if last == len(self.vertices) - 1 else last + 1
+        return lo, hi
+
+    def _resample(self, ks):
+        fresh = self._sample_leaves(ks)
+        for k, leaf in zip(ks, fresh):
+            self.leaves[k] = leaf
+            self.aggregates[k] = self._aggregate(leaf)
+            self.tree.update(k, self.aggregates[k])
+
+    def move_vertex(self, index, point):
+        """Move one vertex; re-samples the (up to two) segments that end at it."""
+        if not 0 <= index < len(self.vertices):
+            raise ValueError(f"index must be between 0 and {len(self.vertices) - 1}")
+        first, last = max(index - 1, 0), min(index + 1, len(self.vertices) - 1)
+        lo, hi = self._span_leaves(first, last)
+        removed = int(self.tree.query(lo, hi)[COUNT])
+        self.vertices[index] = point
+        self._resample(range(lo, hi))
+        return first, last, removed
+
+    def replace_span(self, start, end, points):
+        """
+        Replace the vertices strictly between start and end (start < end) with points; re-samples
+        only the new segments from vertex start to the vertex that was end.
+        """
+        if not 0 <= start < end < len(self.vertices):
+            raise ValueError(f"start and end must satisfy 0 <= start < end <= {len(self.vertices) - 1}")
+        if len(self.vertices) - (end - start - 1) + len(points) > MAX_VERTICES:
+            raise ValueError(f"A route may have at most {MAX_VERTICES} vertices")
+        removed = int(self.tree.query(*self._span_leaves(start, end))[COUNT])
+        self.vertices[start + 1:end] = points
+        new_end = start + len(points) + 1
+        # Segments start .. new_end - 1 are leaves start + 1 .. new_end
+        ks = range(start + 1, new_end + 1)
+        if new_end == end:
+            self._resample(ks)
+        else:
+            # Leaf count changes: splice the new leaves and their aggregates in, and rebuild the
+            # tree from the cached aggregates
+            fresh = self._sample_leaves(ks)
+            self.leaves[start + 1:end + 1] = fresh
+            self.aggregates = np.concatenate([self.aggregates[:start + 1],
+                                              np.array([self._aggregate(leaf) for leaf in fresh]),
+                                              self.aggregates[end + 1:]])
+            self.tree = SegmentTree(self.aggregates)
+        return start, new_end, removed
+
+    def apply(self, edit):
+        """
+        Apply one edit (dict) and return (first vertex, last vertex, number of route points those
+        vertices used to span) for the changed stretch.
+
+        {"op": "move", "index": i, "to": [lat, lon]}
+        {"op": "insert", "after": i, "to": [lat, lon]}
+        {"op": "delete", "index": i}                      (not the first or last vertex)
+        {"op": "replace", "start": i, "end": j, "coordinates": [[lat, lon], ...] | "polyline": "..."}
+        """
+        op = edit.get('op')
+        try:
+            if op == 'move':
+                changed = self.move_vertex(int(edit['index']), parse_vertices({'to': [edit['to']]}, 'to')[0])
+            elif op == 'insert':
+                after = int(edit['after'])
+                changed = self.replace_span(after, after + 1, parse_vertices({'to': [edit['to']]}, 'to'))
+            elif op == 'delete':
+                index = int(edit['index'])
+                if not 0 < index < len(self.vertices) - 1:
+                    raise ValueError("Only interior vertices can be deleted")
+                changed = self.replace_span(index - 1, index + 1, [])
+            elif op == 'replace':
+                changed = self.replace_span(int(edit['start']), int(edit['end']), parse_vertices(edit))
+            else:
+                raise ValueError("op must be one of move, insert, delete, replace")
+        except (KeyError, TypeError, IndexError):
+            raise ValueError(f"Malformed {op} edit")
+        self.edits += 1
+        return changed
+
+    def statistics(self):
+        total = self.tree.total()
+        shade_source = 'layer' if self.leaves[0][2] is not None else 'utci_threshold'
+        stats = {
+            'mean_utci': float(total[SUM] / total[COUNT]),
+            'min_utci': float(total[MIN]),
+            'max_utci': float(total[MAX]),
+            'shade_percentage': float(total[SHADE] / total[SHADE_COUNT] * 100) if total[SHADE_COUNT] else 0.0,
+            'shade_source': shade_source,
+            'point_count': int(total[COUNT]),
+            'vertex_count': len(self.vertices),
+        }
+        if shade_source == 'utci_threshold':
+            stats['shade_threshold'] = self.shade_threshold
+        return stats
+
+    def span(self, first, last, removed=None):
+        """
+        Route points and UTCI from vertex first to vertex last, for redrawing an edited stretch:
+        they replace `removed_points` points starting at `point_offset` in the previous geometry.
+        """
+        lo, hi = self._span_leaves(first, last)
+        span = {
+            'first_vertex': first,
+            'last_vertex': last,
+            'point_offset': int(self.tree.query(0, lo)[COUNT]),
+            'coordinates': [tuple(p) for pts, _, _ in self.leaves[lo:hi] for p in pts],
+            'utci_values': np.concatenate([utci for _, utci, _ in self.leaves[lo:hi]]).tolist(),
+        }
+        if removed is not None:
+            span['removed_points'] = removed
+        return span
+
+    def geometry(self):
+        """Every point of the route with its UTCI (same points as interpolate_geopath_equidistant)."""
+        return {
+            'vertices': [list(v) for v in self.vertices],
+            'coordinates': [tuple(p) for pts, _, _ in self.leaves for p in pts],
+            'utci_values': np.concatenate([utci for _, utci, _ in self.leaves]).tolist(),
+        }
+
+
+class SessionStore:
+    """Thread-safe LRU of RouteSession objects, dropping sessions idle longer than ttl seconds."""
+
+    def __init__(self, max_sessions, ttl):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, session):
+        with self._lock:
+            self._expire()
+            self._sessions[session.id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                inc("route_sessions_evicted_total")
+            set_gauge("route_sessions", len(self._sessions))
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.touched = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def remove(self, session_id):
+        with self._lock:
+            removed = self._sessions.pop(session_id, None) is not None
+            set_gauge("route_sessions", len(self._sessions))
+            return removed
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.touched >= cutoff:
+                break
+            self._sessions.popitem(last=False)
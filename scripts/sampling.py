@@ -0,0 +1,143 @@
+# sampling.py
+"""
+Vectorized UTCI samplers for projected route points (x, y in the raster CRS).
+
+Modes:
+  floor     One cell per point, (row, col) = floor of the inverse transform, clamped to the
+            raster. Same as the original per-point lookup, and the default.
+  bilinear  Interpolated between the four surrounding cell centres.
+  corridor  Mean over a square window of +/- corridor_m around the point's cell, i.e. the
+            exposure across the width of the street rather than on one side of it. Window sums
+            come from the raster's summed-area table (raster_store.Raster.summed_area), so the
+            cost per point is four lookups whatever the buffer width.
+
+Cells without data are ignored by bilinear and corridor; a point with no valid cell in reach
+falls back to its floor sample.
+"""
+
+import numpy as np
+
+SAMPLE_MODES = ("floor", "bilinear", "corridor")
+# Default corridor half-width in metres (about a sidewalk plus a traffic lane)
+DEFAULT_CORRIDOR_M = 5.0
+
+
+def _fractional_indices(raster, x, y):
+    inv = ~raster.transform
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    cols = inv.a * x + inv.b * y + inv.c
+    rows = inv.d * x + inv.e * y + inv.f
+    return rows, cols
+
+
+def _clamped_cells(raster, rows, cols):
+    h, w = raster.shape
+    r = np.clip(np.floor(rows), 0, h - 1).astype(np.intp)
+    c = np.clip(np.floor(cols), 0, w - 1).astype(np.intp)
+    return r, c
+
+
+def _floor_values(raster, r, c):
+    raw = raster.values[r, c].astype(np.float64)
+    return raw / raster.scale if raster.scale != 1.0 else raw
+
+
+def sample_floor(raster, x, y):
+    """UTCI of the cell containing each point (clamped to the raster edge)."""
+    r, c = _clamped_cells(raster, *_fractional_indices(raster, x, y))
+    return _floor_values(raster, r, c)
+
+
+def sample_bilinear(raster, x, y):
+    """UTCI bilinearly interpolated between cell centres."""
+    rows, cols = _fractional_indices(raster, x, y)
+    h, w = raster.shape
+    # Cell centres sit at +0.5; clamp so the 2x2 neighbourhood stays inside the raster
+    v = rows - 0.5
+    u = cols - 0.5
+    r0 = np.clip(np.floor(v), 0, max(h - 2, 0)).astype(np.intp)
+    c0 = np.clip(np.floor(u), 0, max(w - 2, 0)).astype(np.intp)
+    r1 = np.minimum(r0 + 1, h - 1)
+    c1 = np.minimum(c0 + 1, w - 1)
+    tv = np.clip(v - r0, 0.0, 1.0)
+    tu = np.clip(u - c0, 0.0, 1.0)
+
+    total = np.zeros(len(rows))
+    weight = np.zeros(len(rows))
+    for rr, cc, wgt in ((r0, c0, (1 - tv) * (1 - tu)), (r0, c1, (1 - tv) * tu),
+                        (r1, c0, tv * (1 - tu)), (r1, c1, tv * tu)):
+        raw = raster.values[rr, cc]
+        if raster.nodata is not None:
+            wgt = np.where(raw == raster.nodata, 0.0, wgt)
+        if np.issubdtype(raw.dtype, np.floating):
+            nan = np.isnan(raw)
+            wgt = np.where(nan, 0.0, wgt)
+            raw = np.where(nan, 0.0, raw)
+        total += wgt * raw
+        weight += wgt
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = total / weight / raster.scale
+    return _fill_missing(raster, out, weight > 0, rows, cols)
+
+
+def sample_corridor(raster, x, y, corridor_m=DEFAULT_CORRIDOR_M):
+    """Mean UTCI over a (2 * corridor_m)-wide square window centred on each point's cell."""
+    rows, cols = _fractional_indices(raster, x, y)
+    h, w = raster.shape
+    r, c = _clamped_cells(raster, rows, cols)
+    half = int(round(corridor_m / raster.res))
+    top = np.maximum(r - half, 0)
+    bottom = np.minimum(r + half + 1, h)
+    left = np.maximum(c - half, 0)
+    right = np.minimum(c + half + 1, w)
+
+    sat, count_sat = raster.summed_area()
+
+    def window(table):
+        return table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+
+    sums = window(sat).astype(np.float64)
+    # Without a count table every cell is valid, so a window's count is its area
+    counts = window(count_sat) if count_sat is not None else (bottom - top) * (right - left)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = sums / counts / raster.scale
+    return _fill_missing(raster, out, counts > 0, rows, cols)
+
+
+def _fill_missing(raster, out, valid, rows, cols):
+    if not valid.all():
+        r, c = _clamped_cells(raster, rows[~valid], cols[~valid])
+        out[~valid] = _floor_values(raster, r, c)
+    return out
+
+
+def sample_points(raster, x, y, mode="floor", corridor_m=None):
+    """UTCI at projected points for one of SAMPLE_MODES."""
+    if mode == "bilinear":
+        return sample_bilinear(raster, x, y)
+    if mode == "corridor":
+        return sample_corridor(raster, x, y, DEFAULT_CORRIDOR_M if corridor_m is None else corridor_m)
+    return sample_floor(raster, x, y)
+
+
+def parse_sampling_options(data):
+    """
+    Read sampling fields from a request body.
+
+    Fields: "sample_mode" (one of SAMPLE_MODES, default floor), "corridor_m" (corridor half-width
+    in metres, corridor mode only).
+    :return: (mode, corridor_m); corridor_m is None unless mode is corridor
+    """
+    mode = data.get('sample_mode') or 'floor'
+    if mode not in SAMPLE_MODES:
+        raise ValueError(f"sample_mode must be one of {', '.join(SAMPLE_MODES)}")
+    if mode != 'corridor':
+        return mode, None
+    try:
+        corridor_m = float(data.get('corridor_m', DEFAULT_CORRIDOR_M))
+    except (TypeError, ValueError):
+        raise ValueError("corridor_m must be a number")
+    if not 0 <= corridor_m <= 500:
+        raise ValueError("corridor_m must be between 0 and 500 metres")
+    return mode, corridor_m
@@ -0,0 +1,182 @@
+# scoring.py
+"""
+Route scoring shared by the Flask backend and the offline tools: per-route UTCI statistics,
+shade percentage, cross-route normalization and the /api/process-route response payload.
+"""
+
+import numpy as np
+
+# Bottom 90% of the UTCI range across all routes counts as "shade" (relative threshold)
+SHADE_PERCENTILE = 90
+
+
+def compute_route_statistics(route_values, shade_percentile=SHADE_PERCENTILE, weights=None, shade_values=None,
+                             shared=None):
+    """
+    Compute mean/min/max UTCI, shade percentage and normalized mean for each route.
+
+    :param route_values: List of per-route UTCI samples (sequence or 1D array per route)
+    :param shade_percentile: Percentage of the overall min-max range below which a sample counts as shade
+    :param weights: Optional per-route weights aligned with route_values (e.g. metres of route in
+        each raster cell). Means and shade percentages are then weighted, and min/max only consider
+        samples with positive weight. None weights every sample equally.
+    :param shade_values: Optional per-route measured shade (0..1 mask or fraction, NaN where unknown)
+        aligned with route_values. When given, shade percentages are the (weighted) mean shade
+        instead of the share of samples below the relative UTCI threshold.
+    :param shared: Optional shared_segments.SharedSegments the routes were sampled through (with
+        .values set). Means, min/max and threshold shade counts are then combined from per-segment
+        partial aggregates instead of scanning every route's samples. Ignored with weights.
+    :return: dict of per-route numpy arrays plus the shade threshold and the range of route means
+    """
+    values = [np.asarray(v, dtype=np.float64) for v in route_values]
+    if weights is None:
+        weights = [np.ones(len(v)) for v in values]
+    else:
+        weights = [np.asarray(w, dtype=np.float64) for w in weights]
+        # A route with no length (e.g. a single vertex) falls back to equal weights
+        weights = [w if w.sum() > 0 else np.ones(len(w)) for w in weights]
+        shared = None
+    if shared is not None:
+        sums, counts, mins, maxs = shared.route_aggregates()
+        means = sums / counts
+    else:
+        means = np.array([np.average(v, weights=w) for v, w in zip(values, weights)])
+        mins = np.array([v[w > 0].min() for v, w in zip(values, weights)])
+        maxs = np.array([v[w > 0].max() for v, w in zip(values, weights)])
+
+    # Shade threshold as a percentage of the overall range, measured from the minimum
+    overall_min = mins.min()
+    overall_max = maxs.max()
+    shade_threshold = overall_min + ((overall_max - overall_min) * shade_percentile / 100)
+    if shade_values is None and shared is not None:
+        shade_source = 'utci_threshold'
+        shade_percentages = shared.route_counts_below(shade_threshold) / counts * 100
+    elif shade_values is None:
+        shade_source = 'utci_threshold'
+        shade_percentages = np.array([
+            (w[v < shade_threshold].sum() / w.sum()) * 100 if len(v) > 0 else 0
+            for v, w in zip(values, weights)
+        ])
+    else:
+        shade_source = 'layer'
+        shade_percentages = np.array([_measured_shade(s, w) for s, w in zip(shade_values, weights)])
+
+    # Normalize route means to 0-100 across routes (NaN when all routes have the same mean)
+    min_val = means.min()
+    max_val = means.max()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = ((means - min_val) / (max_val - min_val)) * 100
+
+    return {
+        'utci_values': values,
+        'mean': means,
+        'min': mins,
+        'max': maxs,
+        'normalized': normalized,
+        'shade_percentages': shade_percentages,
+        'shade_threshold': float(shade_threshold),
+        'shade_source': shade_source,
+        'utci_range': (float(min_val), float(max_val)),
+    }
+
+
+def _measured_shade(shade, weights):
+    """Percentage of a route in shade from a shade layer, skipping samples without data."""
+    shade = np.asarray(shade, dtype=np.float64)
+    valid = ~np.isnan(shade) & (weights > 0)
+    if not valid.any():
+        return 0.0
+    return float(np.average(np.clip(shade[valid], 0.0, 1.0), weights=weights[valid]) * 100)
+
+
+def sample_indices(n, max_points):
+    """Indices of at most max_points evenly spaced samples out of n, always keeping both endpoints."""
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+    if max_points < 2:
+        return np.array([0, n - 1][:max(max_points, 0)], dtype=np.intp)
+    return np.unique(np.round(np.linspace(0, n - 1, max_points)).astype(np.intp))
+
+
+def raster_runs(stats, i, indices=None):
+    """
+    [[first point, raster index], ...] runs of returned points served by the same raster, or None
+    when the statistics carry no per-point raster ('raster_index', set with a raster registry).
+    """
+    if 'raster_index' not in stats:
+        return None
+    served = np.asarray(stats['raster_index'][i])
+    if indices is not None:
+        served = served[indices]
+    if not len(served):
+        return []
+    starts = np.flatnonzero(np.concatenate(([True], served[1:] != served[:-1])))
+    return [[int(j), int(served[j])] for j in starts]
+
+
+def route_summary(stats, i, directions_entry):
+    """Small per-route summary (statistics, Google duration/distance) without the sample arrays."""
+    summary = {
+        'mean_utci': float(stats['mean'][i]),
+        'min_utci': float(stats['min'][i]),
+        'max_utci': float(stats['max'][i]),
+        'normalized_utci': float(stats['normalized'][i]),
+        'shade_percentage': float(stats['shade_percentages'][i]),
+        'duration': directions_entry['duration'],
+        'distance': directions_entry['distance']
+    }
+    if 'layer_stats' in stats:
+        # Other co-registered layers (shade, sky-view factor, surface temperature), see layer_stack.py
+        summary['layers'] = {name: {k: v[i] for k, v in layer.items()} for name, layer in stats['layer_stats'].items()}
+    return summary
+
+
+def build_route_response(interpolated_routes, google_routes_data, stats, origin, destination,
+                         samples='full', point_indices=None):
+    """
+    Build the JSON-ready /api/process-route payload.
+
+    :param interpolated_routes: List of per-route (lat, lon) lists
+    :param google_routes_data: Directions entries with 'duration' and 'distance' text
+    :param stats: Output of compute_route_statistics
+    :param origin: (lat, lon) of the geocoded origin
+    :param destination: (lat, lon) of the geocoded destination
+    :param samples: 'full' to include per-point utci_values, 'none' to omit them
+    :param point_indices: Optional per-route index arrays selecting which points to return
+        (downsampling or simplification); statistics always use every sample
+    """
+    routes_data = []
+    for i, route in enumerate(interpolated_routes):
+        route_data = route_summary(stats, i, google_routes_data[i])
+        values = stats['utci_values'][i]
+        if point_indices is not None:
+            idx = point_indices[i]
+            route = [route[j] for j in idx]
+            values = values[idx]
+        route_data['coordinates'] = route
+        if samples != 'none':
+            route_data['utci_values'] = values.tolist()  # UTCI sample at each coordinate
+        runs = raster_runs(stats, i, point_indices[i] if point_indices is not None else None)
+        if runs is not None:
+            route_data['raster_runs'] = runs
+        routes_data.append(route_data)
+
+    return response_envelope(routes_data, stats, origin, destination)
+
+
+def response_envelope(routes_data, stats, origin, destination):
+    """Top-level response fields shared by every encoding."""
+    envelope = {
+        'routes': routes_data,
+        'origin': {'lat': origin[0], 'lng': origin[1]},
+        'destination': {'lat': destination[0], 'lng': destination[1]},
+        'utci_range': {
+            'min': stats['utci_range'][0],
+            'max': stats['utci_range'][1]
+        }
+    }
+    if 'layer_stats' in stats:
+        envelope['shade_source'] = stats['shade_source']  # 'layer' (measured) or 'utci_threshold'
+    if 'rasters' in stats:
+        envelope['rasters'] = stats['rasters']  # ids referenced by each route's raster_runs
+    return envelope
@@ -0,0 +1,93 @@
+# shared_segments.py
+"""
+Densify and sample polyline segments shared by several route alternatives only once.
+
+Directions alternatives often share long prefixes and suffixes (leaving the same building, the
+last blocks to the destination). interpolate_geopath_equidistant places the points of each
+segment from its two vertices alone (utils.interpolate_segment), so a segment that appears in
+several alternatives yields identical points every time.
+
+SharedSegments hashes every segment by its end vertices snapped to SNAP_DEG (decoded polylines
+are on a 1e-5 degree grid) and keeps one "piece" per unique segment: its interpolated points,
+stored contiguously in `points`. Each route's first and last vertex are one-point pieces. A
+route is its start piece, its segment pieces in order, then its end piece, which is exactly
+the point list interpolate_geopath_equidistant returns for it.
+
+After the unique points are sampled once (values aligned with `points`), per-route sums, counts,
+minima, maxima and counts below a threshold are assembled from per-piece partial aggregates
+(see scoring.compute_route_statistics(shared=...)).
+"""
+
+import numpy as np
+
+from utils import interpolate_segment
+
+# Vertices closer than this (degrees, about 0.1 m) hash to the same segment end
+SNAP_DEG = 1e-6
+
+
+def _snap(point):
+    return int(round(point[0] / SNAP_DEG)), int(round(point[1] / SNAP_DEG))
+
+
+class SharedSegments:
+    def __init__(self, routes, distance_between_points):
+        """
+        :param routes: Decoded (lat, lon) polylines, one per alternative
+        :param distance_between_points: Spacing in metres, as for interpolate_geopath_equidistant
+        """
+        self.points = []
+        self.route_pieces = []
+        piece_ids = {}
+        starts = []
+
+        def piece(key, make_points):
+            if key not in piece_ids:
+                piece_ids[key] = len(starts)
+                starts.append(len(self.points))
+                self.points.extend(make_points())
+            return piece_ids[key]
+
+        for route in routes:
+            utm_zone = int((route[0][1] + 180) / 6) + 1
+            ids = [piece(('vertex', _snap(route[0])), lambda: [route[0]])]
+            for a, b in zip(route[:-1], route[1:]):
+                ids.append(piece(('segment', utm_zone, _snap(a), _snap(b)),
+                                 lambda: interpolate_segment(a, b, distance_between_points, utm_zone)))
+            ids.append(piece(('vertex', _snap(route[-1])), lambda: [route[-1]]))
+            self.route_pieces.append(np.array(ids, dtype=np.intp))
+
+        # Piece p covers points[starts[p]:starts[p] + sizes[p]]; every piece has at least one point
+        self.piece_starts = np.array(starts, dtype=np.intp)
+        self.piece_sizes = np.diff(np.append(self.piece_starts, len(self.points)))
+        self.route_index = [
+            np.concatenate([np.arange(self.piece_starts[p], self.piece_starts[p] + self.piece_sizes[p]) for p in ids])
+            for ids in self.route_pieces
+        ]
+        self.total_points = sum(len(index) for index in self.route_index)
+        # UTCI of each unique point, set once sampled (utils.create_shapefiles_and_extract_raster_values)
+        self.values = None
+
+    def routes(self):
+        """Interpolated (lat, lon) points per route, identical to interpolate_geopath_equidistant."""
+        return [[self.points[i] for i in index] for index in self.route_index]
+
+    def _per_route(self, piece_values, reduce):
+        return np.array([reduce(piece_values[ids]) for ids in self.route_pieces])
+
+    def route_aggregates(self, values=None):
+        """
+        Per-route (sums, counts, mins, maxs) of values at the unique points, combined from per-piece partials.
+        """
+        values = np.asarray(self.values if values is None else values, dtype=np.float64)
+        sums = np.add.reduceat(values, self.piece_starts)
+        mins = np.minimum.reduceat(values, self.piece_starts)
+        maxs = np.maximum.reduceat(values, self.piece_starts)
+        return (self._per_route(sums, np.sum), self._per_route(self.piece_sizes, np.sum),
+                self._per_route(mins, np.min), self._per_route(maxs, np.max))
+
+    def route_counts_below(self, threshold, values=None):
+        """Per-route number of samples below threshold, from per-piece counts."""
+        values = np.asarray(self.values if values is None else values, dtype=np.float64)
+        below = np.add.reduceat((values < threshold).astype(np.intp), self.piece_starts)
+        return self._per_route(below, np.sum)
@@ -0,0 +1,159 @@
+# simplify.py
+"""
+Level-of-detail simplification of returned route geometry that keeps UTCI change-points.
+
+Douglas-Peucker runs on (x, y, UTCI * utci_weight): x/y are local metres, and the UTCI axis is
+scaled so that a 1 °C change counts as `utci_weight` metres of deviation. A hot/cool transition
+therefore looks like a corner and survives, while long runs of near-constant heat along a
+straight street collapse into a single segment.
+
+Each vertex gets a DP importance (its deviation from the chord when it was split off, capped by
+its parent's importance). Thresholding importance at a tolerance gives exactly the DP result for
+that tolerance, and taking the top-N gives a nested hierarchy for a target vertex count, so both
+request styles come from one pass. The pass is level-synchronous: all ranges at one recursion
+depth are measured in a single vectorized NumPy step.
+"""
+
+import numpy as np
+
+# Metres of deviation equivalent to a 1 °C UTCI change
+UTCI_WEIGHT_M = 10.0
+# Web Mercator ground resolution at zoom 0 on the equator (metres per 256-px tile pixel)
+_M_PER_PIXEL_Z0 = 156543.03392
+
+
+def tolerance_for_zoom(zoom, lat):
+    """About one screen pixel in metres at this Web Mercator zoom level and latitude."""
+    return _M_PER_PIXEL_Z0 * np.cos(np.radians(lat)) / (2 ** zoom)
+
+
+def _local_metres(coords):
+    """Equirectangular projection of (lat, lon) pairs to metres around their mean latitude."""
+    lat = coords[:, 0]
+    lon = coords[:, 1]
+    # NaN rows (missing coordinates) must not shift the projection of the others
+    lat0 = np.radians(np.nanmean(lat)) if np.isfinite(lat).any() else 0.0
+    y = np.radians(lat) * 6_371_000.0
+    x = np.radians(lon) * 6_371_000.0 * np.cos(lat0)
+    return x, y
+
+
+def dp_importance(points):
+    """
+    Douglas-Peucker importance for each row of points (n, d). Endpoints get +inf.
+
+    Keeping the vertices with importance > tol reproduces DP with tolerance tol.
+    """
+    n = len(points)
+    importance = np.zeros(n)
+    if n == 0:
+        return importance
+    importance[0] = importance[-1] = np.inf
+    starts = np.array([0])
+    ends = np.array([n - 1])
+    parent = np.array([np.inf])
+
+    while len(starts):
+        interior = ends - starts - 1
+        active = interior > 0
+        starts, ends, parent, interior = starts[active], ends[active], parent[active], interior[active]
+        if not len(starts):
+            break
+
+        # Flattened interior indices of every active range, plus the range each belongs to
+        seg = np.repeat(np.arange(len(starts)), interior)
+        offsets = np.concatenate(([0], np.cumsum(interior)[:-1]))
+        idx = np.arange(len(seg)) - offsets[seg] + starts[seg] + 1
+
+        a = points[starts][seg]
+        v = points[ends][seg] - a
+        w = points[idx] - a
+        vv = np.einsum('ij,ij->i', v, v)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(vv > 0, np.einsum('ij,ij->i', w, v) / vv, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        # A NaN coordinate or UTCI (nodata sample) counts as no deviation, so every range still has a maximum
+        dist = np.nan_to_num(np.linalg.norm(w - t[:, None] * v, axis=1), nan=0.0)
+
+        # Farthest interior point per range (first one on ties)
+        max_dist = np.maximum.reduceat(dist, offsets)
+        is_max = dist == max_dist[seg]
+        first = np.unique(seg[is_max], return_index=True)[1]
+        split = idx[is_max][first]
+
+        imp = np.minimum(max_dist, parent)
+        importance[split] = imp
+
+        starts, ends, parent = (np.concatenate((starts, split)),
+                                np.concatenate((split, ends)),
+                                np.concatenate((imp, imp)))
+    return importance
+
+
+def simplify_indices(coords, utci_values, tolerance_m=None, max_vertices=None, utci_weight=UTCI_WEIGHT_M):
+    """
+    Indices of the vertices to keep for one route.
+
+    :param coords: (lat, lon) pairs
+    :param utci_values: UTCI sample at each coordinate
+    :param tolerance_m: Keep vertices deviating more than this (metres, UTCI axis scaled by utci_weight)
+    :param max_vertices: Keep at most this many of the most important vertices
+    :return: Sorted index array (always includes both endpoints)
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    n = len(coords)
+    if n <= 2:
+        return np.arange(n)
+    x, y = _local_metres(coords)
+    z = np.asarray(utci_values, dtype=np.float64) * utci_weight
+    importance = dp_importance(np.column_stack((x, y, z)))
+
+    keep = np.ones(n, dtype=bool)
+    if tolerance_m is not None:
+        keep &= importance > tolerance_m
+    if max_vertices is not None and np.count_nonzero(keep) > max_vertices:
+        candidates = np.flatnonzero(keep)
+        order = np.argsort(-importance[candidates], kind='stable')
+        keep[:] = False
+        keep[candidates[order[:max(max_vertices, 2)]]] = True
+    return np.flatnonzero(keep)
+
+
+def parse_simplify_options(data):
+    """
+    Read simplification fields from a request body.
+
+    Fields: "simplify_tolerance" (metres), "zoom" (Web Mercator level, ~1 px tolerance),
+    "max_vertices" (target vertex count per route), "utci_weight" (metres per °C).
+    :return: dict of options, or None if no simplification was requested
+    """
+    tolerance = data.get('simplify_tolerance')
+    zoom = data.get('zoom')
+    max_vertices = data.get('max_vertices')
+    if tolerance is None and zoom is None and max_vertices is None:
+        return None
+    try:
+        options = {
+            'tolerance_m': float(tolerance) if tolerance is not None else None,
+            'zoom': float(zoom) if zoom is not None else None,
+            'max_vertices': int(max_vertices) if max_vertices is not None else None,
+            'utci_weight': float(data.get('utci_weight', UTCI_WEIGHT_M)),
+        }
+    except (TypeError, ValueError):
+        raise ValueError("simplify_tolerance, zoom, max_vertices and utci_weight must be numbers")
+    if options['max_vertices'] is not None and options['max_vertices'] < 2:
+        raise ValueError("max_vertices must be at least 2")
+    if options['tolerance_m'] is not None and options['tolerance_m'] < 0:
+        raise ValueError("simplify_tolerance must be non-negative")
+    return options
+
+
+def simplify_routes(interpolated_routes, route_values, options):
+    """Per-route index arrays for parse_simplify_options() output."""
+    indices = []
+    for route, values in zip(interpolated_routes, route_values):
+        tolerance = options['tolerance_m']
+        if tolerance is None and options['zoom'] is not None:
+            tolerance = tolerance_for_zoom(options['zoom'], np.mean([p[0] for p in route]))
+        indices.append(simplify_indices(route, values, tolerance, options['max_vertices'], options['utci_weight']))
+    return indices
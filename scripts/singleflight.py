@@ -0,0 +1,71 @@
+# singleflight.py
+"""
+Single-flight coalescing: concurrent calls with the same key share one in-progress computation.
+
+The first caller (leader) runs the function; callers arriving while it runs (followers) wait for
+its result instead of repeating the work. If the computation raises, every waiter gets the same
+exception (a RuntimeError if the leader was interrupted by a BaseException such as
+KeyboardInterrupt). Followers give up after `timeout` seconds with SingleFlightTimeout; the
+leader keeps running and later callers can still join it.
+"""
+
+import threading
+
+from metrics import inc
+
+
+class SingleFlightTimeout(Exception):
+    """A follower stopped waiting for the shared computation."""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, timeout=None):
+        """Return fn()'s result, running it at most once at a time per key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                # Waiters are released in finally whatever the leader hit (including
+                # KeyboardInterrupt/SystemExit), then the leader re-raises it
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        inc("singleflight_coalesced_total", flight=self.name)
+        if not call.done.wait(timeout):
+            inc("singleflight_timeouts_total", flight=self.name)
+            raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for an identical in-flight request")
+        if isinstance(call.error, Exception):
+            raise call.error
+        if call.error is not None:
+            # Interrupts belong to the leader's thread; followers see a plain failure
+            raise RuntimeError("The shared in-flight computation was interrupted") from call.error
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
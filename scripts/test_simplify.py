@@ -0,0 +1,21 @@
+import numpy as np
+
+from simplify import dp_importance, simplify_indices
+
+
+def test_dp_importance_nan_row():
+    points = np.column_stack((np.arange(6.0), [0, 3, 0, np.nan, 0, 0], np.zeros(6)))
+    importance = dp_importance(points)
+    assert importance.shape == (6,)
+    assert np.isinf(importance[[0, -1]]).all()
+    assert importance[1] > 0
+
+
+def test_simplify_indices_nan_utci_and_coordinate():
+    coords = [(30.28 + i * 1e-4, -97.74) for i in range(10)]
+    coords[4] = (np.nan, np.nan)
+    utci = np.linspace(30, 35, 10)
+    utci[6] = np.nan
+    keep = simplify_indices(coords, utci, tolerance_m=1.0)
+    assert keep[0] == 0 and keep[-1] == 9
+    assert np.all(np.diff(keep) > 0)
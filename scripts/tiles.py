@@ -0,0 +1,253 @@
+# tiles.py
+"""
+XYZ (Web Mercator, 256 px) PNG tiles of the resident UTCI raster.
+
+Rendering a tile:
+  1. Project a coarse 17x17 grid of tile positions from EPSG:3857 to the raster CRS
+     (EPSG:6343) and bilinearly upsample it to every pixel centre. The projection is smooth
+     at tile scale, so this is visually exact and avoids 65k pyproj calls per tile.
+  2. Pick the overview level whose cell size matches the tile's pixel size, measured in raster
+     cells through the raster's inverse transform over the whole tile (low zooms read the
+     small mean-decimated pyramids in raster_store, not the full-resolution band).
+  3. Color-map with a 256-entry RGBA lookup table in one vectorized take().
+  4. Encode the PNG with zlib directly (no imaging dependency).
+
+Tiles are cached in memory (byte-bounded LRU) and on disk under <cache_dir>/<raster version>/,
+so a new raster starts a fresh cache and the old version's directory is pruned. The disk cache
+is also bounded (max_disk_bytes): disk hits refresh a tile's mtime, and once the directory
+grows past the limit the least recently used tiles are deleted down to 90% of it.
+"""
+
+import os
+import shutil
+import struct
+import threading
+import zlib
+
+import numpy as np
+from pyproj import Transformer
+
+from metrics import stage_timer, inc
+from raster_store import load_raster, raster_version
+from result_cache import ResultCache
+
+TILE_SIZE = 256
+WEB_MERCATOR_HALF = 20037508.342789244
+_GRID = 16  # coarse projection grid cells per tile side
+
+# Piecewise-linear heat ramp, anchored on the UTCI heat stress categories (°C -> RGB)
+COLOR_STOPS = [
+    (9.0, (49, 54, 149)),      # no thermal stress (cool end)
+    (26.0, (116, 173, 209)),   # moderate heat stress starts
+    (32.0, (254, 224, 144)),   # strong heat stress
+    (38.0, (244, 109, 67)),    # very strong heat stress
+    (46.0, (165, 0, 38)),      # extreme heat stress
+]
+
+_local = threading.local()
+
+
+def build_lut(vmin, vmax, alpha=190):
+    """256 x RGBA uint8 lookup table spanning vmin..vmax °C; index 256 is transparent (no data)."""
+    temps = np.linspace(vmin, vmax, 256)
+    stops_t = np.array([s[0] for s in COLOR_STOPS])
+    stops_rgb = np.array([s[1] for s in COLOR_STOPS], dtype=np.float64)
+    lut = np.zeros((257, 4), dtype=np.uint8)
+    for ch in range(3):
+        lut[:256, ch] = np.round(np.interp(temps, stops_t, stops_rgb[:, ch]))
+    lut[:256, 3] = alpha
+    return lut
+
+
+def encode_png(rgba):
+    """Encode an (h, w, 4) uint8 array as PNG bytes."""
+    h, w, _ = rgba.shape
+    raw = np.empty((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 0] = 0  # filter type None for every scanline
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    ihdr = struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0)  # 8-bit RGBA
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr)
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) + chunk(b"IEND", b""))
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def _transformer(crs):
+    """Per-thread cached EPSG:3857 -> crs transformer (pyproj transformers are not shared across threads)."""
+    cache = getattr(_local, "transformers", None)
+    if cache is None:
+        cache = _local.transformers = {}
+    if crs not in cache:
+        cache[crs] = Transformer.from_crs("EPSG:3857", crs, always_xy=True)
+    return cache[crs]
+
+
+def tile_bounds(z, x, y):
+    """(minx, miny, maxx, maxy) of tile z/x/y in EPSG:3857 metres."""
+    size = 2 * WEB_MERCATOR_HALF / 2 ** z
+    minx = -WEB_MERCATOR_HALF + x * size
+    maxy = WEB_MERCATOR_HALF - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def _upsample(grid, n):
+    """Bilinearly upsample a (_GRID+1)^2 grid sampled at pixel edges to n x n pixel centres."""
+    pos = (np.arange(n) + 0.5) * _GRID / n
+    k = np.minimum(pos.astype(np.intp), _GRID - 1)
+    t = pos - k
+    rows = grid[k] * (1 - t)[:, None] + grid[k + 1] * t[:, None]
+    return rows[:, k] * (1 - t)[None, :] + rows[:, k + 1] * t[None, :]
+
+
+def render_tile(raster, z, x, y, lut, vmin, vmax):
+    """PNG bytes for tile z/x/y of a raster_store.Raster, colored by lut over vmin..vmax °C."""
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    gx = np.linspace(minx, maxx, _GRID + 1)
+    gy = np.linspace(maxy, miny, _GRID + 1)
+    mx, my = np.meshgrid(gx, gy)
+    rx, ry = _transformer(raster.crs).transform(mx, my)
+
+    # Quick reject: coarse grid entirely outside the raster
+    left, bottom, right, top = raster.bounds
+    if rx.max() < left or rx.min() > right or ry.max() < bottom or ry.min() > top:
+        return EMPTY_TILE
+
+    # Raster (row, col) of the coarse grid via the inverse affine
+    inv = ~raster.transform
+    grid_cols = inv.a * rx + inv.b * ry + inv.c
+    grid_rows = inv.d * rx + inv.e * ry + inv.f
+
+    # Overview whose cell size matches one tile pixel: raster cells per pixel, averaged over the
+    # tile along both axes (the projection scale varies across low-zoom tiles)
+    across = np.hypot(np.diff(grid_cols, axis=1), np.diff(grid_rows, axis=1)).mean()
+    down = np.hypot(np.diff(grid_cols, axis=0), np.diff(grid_rows, axis=0)).mean()
+    cells_per_pixel = (across + down) / 2 * _GRID / TILE_SIZE
+    level = int(np.floor(np.log2(max(cells_per_pixel, 1.0))))
+    level = min(level, len(raster.overviews()) if level > 0 else 0)
+
+    # Every pixel centre, bilinearly upsampled from the grid (the affine commutes with it)
+    cols = _upsample(grid_cols, TILE_SIZE)
+    rows = _upsample(grid_rows, TILE_SIZE)
+    values = raster.sample_level(level, rows, cols)
+
+    idx = np.clip((values - vmin) * (255.0 / (vmax - vmin)), 0, 255)
+    idx = np.where(np.isnan(values), 256, idx).astype(np.intp)
+    return encode_png(lut[idx])
+
+
+class TileCache:
+    """In-memory LRU over an on-disk tile directory, both keyed by raster version."""
+
+    def __init__(self, cache_dir, max_bytes, vmin, vmax, max_disk_bytes=0):
+        """
+        :param max_bytes: Limit for tiles held in memory
+        :param max_disk_bytes: Limit for the current version's tile directory (0 = unbounded)
+        """
+        self.cache_dir = cache_dir
+        self.memory = ResultCache(max_bytes, name="tile_cache")
+        self.max_disk_bytes = max_disk_bytes
+        self._disk_key = None
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._pruning = threading.Lock()
+        self.vmin, self.vmax = vmin, vmax
+        self.lut = build_lut(vmin, vmax)
+
+    def _disk_tiles(self, disk_key):
+        """(mtime, size, path) of every tile stored for disk_key."""
+        tiles = []
+        for root, _, files in os.walk(os.path.join(self.cache_dir, disk_key)):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # removed concurrently
+                tiles.append((st.st_mtime, st.st_size, path))
+        return tiles
+
+    def _prune_disk(self, disk_key):
+        with self._lock:
+            if disk_key == self._disk_key:
+                return
+            self._disk_key = disk_key
+            self._disk_bytes = 0
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name != disk_key:
+                    shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+        # Tiles kept from an earlier run count towards the limit
+        disk_bytes = sum(size for _, size, _ in self._disk_tiles(disk_key))
+        with self._lock:
+            self._disk_bytes += disk_bytes
+        self._enforce_disk_limit(disk_key)
+
+    def _enforce_disk_limit(self, disk_key):
+        """Delete least recently used tiles until the directory is under 90% of max_disk_bytes."""
+        if not self.max_disk_bytes or self._disk_bytes <= self.max_disk_bytes:
+            return
+        if not self._pruning.acquire(blocking=False):
+            return  # another request is already pruning
+        try:
+            tiles = sorted(self._disk_tiles(disk_key))
+            disk_bytes = sum(size for _, size, _ in tiles)
+            target = self.max_disk_bytes * 0.9
+            evicted = 0
+            for _, size, path in tiles:
+                if disk_bytes <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                disk_bytes -= size
+                evicted += 1
+            with self._lock:
+                if disk_key == self._disk_key:
+                    self._disk_bytes = disk_bytes
+            if evicted:
+                inc("tile_disk_cache_evictions_total", evicted)
+        finally:
+            self._pruning.release()
+
+    def get(self, raster_path, z, x, y):
+        """CacheEntry for the tile, rendering (and caching) it on a miss."""
+        version = raster_version(raster_path)
+        self.memory.set_version(version)
+        key = f"{z}/{x}/{y}"
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry
+        disk_key = f"{version}-{self.vmin:g}-{self.vmax:g}"  # color range changes also start fresh
+        self._prune_disk(disk_key)
+
+        path = os.path.join(self.cache_dir, disk_key, str(z), str(x), f"{y}.png")
+        if os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    body = f.read()
+                os.utime(path)  # mtime is the LRU clock for disk pruning
+            except OSError:
+                body = None  # pruned between the check and the read
+        else:
+            body = None
+        if body is not None:
+            inc("tile_disk_cache_hits_total")
+        else:
+            with stage_timer("tile_render"):
+                body = render_tile(load_raster(raster_path), z, x, y, self.lut, self.vmin, self.vmax)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)  # atomic, so concurrent readers never see a partial tile
+            with self._lock:
+                if disk_key == self._disk_key:
+                    self._disk_bytes += len(body)
+            self._enforce_disk_limit(disk_key)
+        return self.memory.put(key, body, "image/png", version)
@@ -0,0 +1,137 @@
+# trace_recorder.py
+"""
+Optional capture of route computations into an append-only trace file, for offline replay.
+
+Set TRACE_PATH (e.g. output/traces.jsonl.gz) to record every route computation (result-cache
+misses of /api/process-route and /api/process-route/stream); TRACE_SAMPLE_RATE (0..1, default
+1) records only that share of them. Each trace is one JSON object, appended as its own gzip
+member, so the file stays valid while it grows and `zcat` shows one trace per line:
+
+  {"v": 1, "time": <epoch s>, "endpoint", "origin", "destination", "options",
+   "raster": {"path": <file name or null with a registry>, "version"},
+   "geocode": [[lat, lon], [lat, lon]], "directions": [{"polyline", "duration", "distance"}, ...],
+   "stages": {<stage>: seconds}, "total_s", "result": {"routes": [[mean, min, max, shade %], ...],
+   "sha1": <response body hash>}, "error": <message, if the computation failed>}
+
+"geocode" and "directions" are the external API answers exactly as the pipeline consumed them
+(whether they came from Google, the gazetteer or a cache), so replay_traces.py can re-run the
+scoring pipeline with no network. Stage timings come from metrics.stage_timer.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import add_stage_listener, inc
+
+TRACE_VERSION = 1
+TRACE_PATH = os.environ.get('TRACE_PATH', '')
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1'))
+
+_local = threading.local()
+_lock = threading.Lock()
+_path = None
+_listening = False
+
+
+def _on_stage(stage, event, elapsed):
+    trace = getattr(_local, "trace", None)
+    if trace is not None and event == "end":
+        trace["stages"][stage] = trace["stages"].get(stage, 0.0) + elapsed
+
+
+def enable(path):
+    """Start appending traces to path (None stops recording)."""
+    global _path, _listening
+    _path = path or None
+    if not _listening:
+        add_stage_listener(_on_stage)
+        _listening = True
+
+
+def note(field, value):
+    """Set a field of the trace being captured on this thread (no-op when not capturing)."""
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace[field] = value
+
+
+def note_result(stats, body=None):
+    """Record per-route [mean, min, max, shade %] (from scoring.compute_route_statistics) and the body hash."""
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return
+    result = {"routes": [[float(stats["mean"][i]), float(stats["min"][i]), float(stats["max"][i]),
+                          float(stats["shade_percentages"][i])] for i in range(len(stats["mean"]))]}
+    if body is not None:
+        result["sha1"] = hashlib.sha1(body).hexdigest()
+    trace["result"] = result
+
+
+@contextmanager
+def tracing(trace):
+    """Collect this thread's stage timings and notes into trace (a dict) without writing it anywhere."""
+    if not _listening:
+        enable(_path)
+    trace.setdefault("stages", {})
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    start = time.perf_counter()
+    try:
+        yield trace
+    except Exception as e:
+        trace["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        trace["total_s"] = time.perf_counter() - start
+        _local.trace = previous
+
+
+@contextmanager
+def capture(endpoint, origin, destination, options, raster_path, version):
+    """Record one route computation if recording is on (and this request is sampled)."""
+    if _path is None or random.random() >= TRACE_SAMPLE_RATE:
+        yield None
+        return
+    trace = {
+        "v": TRACE_VERSION, "time": time.time(), "endpoint": endpoint, "origin": origin,
+        "destination": destination, "options": options,
+        "raster": {"path": os.path.basename(raster_path) if raster_path else None, "version": version},
+    }
+    try:
+        with tracing(trace):
+            yield trace
+    finally:
+        _append(trace)
+
+
+def _append(trace):
+    data = gzip.compress((json.dumps(trace, separators=(",", ":"), default=float) + "\n").encode("utf-8"))
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(_path) or ".", exist_ok=True)
+            with open(_path, "ab") as f:
+                f.write(data)
+        inc("traces_recorded_total")
+    except OSError as e:
+        print(f"⚠️ Could not write trace to {_path}: {e}")
+
+
+def read_traces(path):
+    """Traces in a trace file, in order (a member cut short by a crash ends the file)."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, OSError, ValueError) as e:
+            print(f"⚠️ Trace file {path} ends with a damaged record ({e}); stopping there")
+
+
+if TRACE_PATH:
+    enable(TRACE_PATH)
@@ -1,37 +1,127 @@
 # utils.py
 
-import time
 import requests
 import polyline
 import numpy as np
 from pyproj import Proj, transform, Geod
 import geopandas as gpd
 import rasterio
+from rasterio.transform import rowcol
+from rasterio.windows import Window
 from shapely.geometry import Point
 import os
+import struct
+import threading
 try:
     import streamlit as st
 except ImportError:
     st = None  # streamlit not available (e.g., in Flask backend)
 
+from metrics import stage_timer
+from raster_store import load_raster
+from sampling import sample_points
+from layer_stack import is_stack, open_stack
+from admission import TokenBucket
+from circuit_breaker import CircuitBreaker, GuardedApi, UpstreamError
+from cache_backends import make_cache, pack_strings, unpack_strings
+from result_cache import normalize_place
+from gazetteer import load_gazetteer
+
+# Point at google_api_stub.py (e.g. http://localhost:5002) for offline load tests
+GOOGLE_MAPS_API_BASE = os.environ.get('GOOGLE_MAPS_API_BASE', 'https://maps.googleapis.com').rstrip('/')
+# Outbound Google calls per second (burst = bucket size; 0 disables). A call that cannot get a token
+# within GOOGLE_RATE_MAX_WAIT seconds raises admission.Overloaded instead of using up the quota.
+geocode_limiter = TokenBucket('geocode', float(os.environ.get('GOOGLE_GEOCODE_RPS', '20')),
+                              float(os.environ.get('GOOGLE_GEOCODE_BURST', '40')))
+directions_limiter = TokenBucket('directions', float(os.environ.get('GOOGLE_DIRECTIONS_RPS', '10')),
+                                 float(os.environ.get('GOOGLE_DIRECTIONS_BURST', '20')))
+GOOGLE_RATE_MAX_WAIT = float(os.environ.get('GOOGLE_RATE_MAX_WAIT', '2'))
+# Seconds before a Google call counts as failed. GOOGLE_BREAKER_FAILURES consecutive failures open the
+# API's circuit breaker for GOOGLE_BREAKER_RESET seconds; meanwhile the last good answers are served
+# and refreshed in the background (see circuit_breaker.py).
+GOOGLE_API_TIMEOUT = float(os.environ.get('GOOGLE_API_TIMEOUT', '5'))
+GOOGLE_BREAKER_FAILURES = int(os.environ.get('GOOGLE_BREAKER_FAILURES', '5'))
+GOOGLE_BREAKER_RESET = float(os.environ.get('GOOGLE_BREAKER_RESET', '30'))
+# Geocodes and directions are reused for GOOGLE_CACHE_TTL seconds and kept as fallback for
+# GOOGLE_STALE_TTL; up to GOOGLE_STALE_CACHE_MAX per API in process, plus CACHE_URL if set
+GOOGLE_CACHE_TTL = float(os.environ.get('GOOGLE_CACHE_TTL', '86400'))
+GOOGLE_STALE_TTL = float(os.environ.get('GOOGLE_STALE_TTL', str(7 * 86400)))
+GOOGLE_STALE_CACHE_MAX = int(os.environ.get('GOOGLE_STALE_CACHE_MAX', '10000'))
+
+
+def pack_geocode(location):
+    """(lat, lon, Google's formatted address or None) as two doubles and the UTF-8 address."""
+    lat, lon, formatted_address = location
+    return struct.pack('<dd', lat, lon) + (formatted_address or '').encode('utf-8')
+
+
+def unpack_geocode(data):
+    lat, lon = struct.unpack_from('<dd', data)
+    return lat, lon, data[16:].decode('utf-8') or None
+
+
+def pack_directions(routes_data):
+    """Directions entries as length-prefixed strings; polylines stay in Google's compact encoding."""
+    return pack_strings(*(field for route in routes_data
+                          for field in (route['polyline'], route['duration'], route['distance'])))
+
+
+def unpack_directions(data):
+    fields = unpack_strings(data)
+    return [{'polyline': p, 'duration': t, 'distance': d} for p, t, d in zip(fields[::3], fields[1::3], fields[2::3])]
+
+
+geocode_api = GuardedApi(CircuitBreaker('geocode', GOOGLE_BREAKER_FAILURES, GOOGLE_BREAKER_RESET),
+                         make_cache('geocode', max_entries=GOOGLE_STALE_CACHE_MAX),
+                         pack_geocode, unpack_geocode, GOOGLE_CACHE_TTL, GOOGLE_STALE_TTL)
+directions_api = GuardedApi(CircuitBreaker('directions', GOOGLE_BREAKER_FAILURES, GOOGLE_BREAKER_RESET),
+                            make_cache('directions', max_entries=GOOGLE_STALE_CACHE_MAX),
+                            pack_directions, unpack_directions, GOOGLE_CACHE_TTL, GOOGLE_STALE_TTL)
+# Local gazetteer of named places (CSV or GeoJSON, see gazetteer.py; unset: none) answered before
+# Google. Places Google geocodes are learned under their formatted address once geocoded
+# GAZETTEER_LEARN_MIN_HITS times, and appended to GAZETTEER_LEARNED_PATH ("" keeps them in memory)
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH', '')
+GAZETTEER_LEARNED_PATH = os.environ.get('GAZETTEER_LEARNED_PATH',
+                                        os.path.join(_SCRIPT_DIR, 'output', 'learned_places.csv'))
+GAZETTEER_LEARN = os.environ.get('GAZETTEER_LEARN', '1') != '0'
+GAZETTEER_LEARN_MAX = int(os.environ.get('GAZETTEER_LEARN_MAX', '10000'))
+GAZETTEER_LEARN_MIN_HITS = int(os.environ.get('GAZETTEER_LEARN_MIN_HITS', '3'))
+gazetteer = load_gazetteer(GAZETTEER_PATH, GAZETTEER_LEARNED_PATH or None, GAZETTEER_LEARN_MAX,
+                           GAZETTEER_LEARN_MIN_HITS)
+# Google statuses that mean the service (not the request) failed
+GOOGLE_ERROR_STATUSES = ('OVER_QUERY_LIMIT', 'REQUEST_DENIED', 'UNKNOWN_ERROR')
+
+
+def _google_get(url, params=None):
+    """GET a Google API and return its JSON; raises UpstreamError on errors, timeouts and error statuses."""
+    try:
+        response = requests.get(url, params=params, timeout=GOOGLE_API_TIMEOUT)
+        if response.status_code != 200:
+            raise UpstreamError(f"HTTP {response.status_code}")
+        data = response.json()
+    except requests.Timeout:
+        raise UpstreamError(f"timed out after {GOOGLE_API_TIMEOUT}s")
+    except (requests.RequestException, ValueError) as e:
+        raise UpstreamError(str(e))
+    if data.get('status') in GOOGLE_ERROR_STATUSES:
+        raise UpstreamError(f"status {data['status']}")
+    return data
 
 
-def _log_profile(step_name, elapsed_sec):
-    """Log profile timing with [PROFILE] prefix for greppable logs."""
-    print(f"[PROFILE] utils.{step_name}: {elapsed_sec:.3f}s", flush=True)
+def get_directions_polylines(origin, destination, mode='walking', api_key=''):
+    """Walking alternatives between two "lat, lon" strings; raises circuit_breaker.UpstreamUnavailable if Google is failing."""
+    return directions_api.call(f"{mode}:{origin}:{destination}",
+                               lambda: _get_directions_polylines(origin, destination, mode, api_key))
 
 
-def get_directions_polylines(origin, destination, mode='walking', api_key=''):
-    t0 = time.perf_counter()
-    url = f"https://maps.googleapis.com/maps/api/directions/json?origin={origin}&destination={destination}&mode={mode}&alternatives=true&key={api_key}"
+def _get_directions_polylines(origin, destination, mode, api_key):
+    url = f"{GOOGLE_MAPS_API_BASE}/maps/api/directions/json?origin={origin}&destination={destination}&mode={mode}&alternatives=true&key={api_key}"
 
+    directions_limiter.acquire(GOOGLE_RATE_MAX_WAIT)
+    with stage_timer("directions"):
+        data = _google_get(url)
     try:
-        t = time.perf_counter()
-        response = requests.get(url)
-        _log_profile("directions_http_request", time.perf_counter() - t)
-        t = time.perf_counter()
-        data = response.json()
-        _log_profile("directions_json_parse", time.perf_counter() - t)
         routes_data = []
 
         if data['status'] == 'OK':
@@ -49,14 +139,12 @@ def get_directions_polylines(origin, destination, mode='walking', api_key=''):
                     'duration': duration,
                     'distance': distance
                 })
-            _log_profile("get_directions_polylines(TOTAL)", time.perf_counter() - t0)
             return routes_data
         else:
             print("Failed to retrieve directions")
             return []
-    except requests.RequestException as e:
-        print(f"Request failed: {e}")
-        return []
+    except (KeyError, IndexError, TypeError) as e:
+        raise UpstreamError(f"malformed directions response: {e}")
     
 
 def decode_polyline(polyline_str):
@@ -108,42 +196,59 @@ def interpolate_geopath_equidistant(path, distance_between_points):
     :param distance_between_points: Desired approximate distance between interpolated points (in meters)
     :return: List of interpolated (latitude, longitude) tuples, including original points
     """
-    geod = Geod(ellps='WGS84')
     utm_zone = int((path[0][1] + 180) / 6) + 1
-    proj_utm = Proj(f'+proj=utm +zone={utm_zone} +ellps=WGS84')
-    proj_latlon = Proj(proj='latlong', ellps='WGS84')
-    
-    # Calculate total path distance and determine the number of points to interpolate
-    total_distance = 0
-    for i in range(len(path) - 1):
-        _, _, distance = geod.inv(path[i][1], path[i][0], path[i+1][1], path[i+1][0])
-        total_distance += distance
-    
-    num_points_total = max(int(total_distance / distance_between_points), 1)
     interpolated_path = [path[0]]
     
     for i in range(len(path) - 1):
-        # Convert current pair of points to UTM
-        x1, y1 = transform(proj_latlon, proj_utm, path[i][1], path[i][0])
-        x2, y2 = transform(proj_latlon, proj_utm, path[i+1][1], path[i+1][0])
-        
-        # Calculate distance for the current segment to determine segment-specific interpolation
-        _, _, segment_distance = geod.inv(path[i][1], path[i][0], path[i+1][1], path[i+1][0])
-        num_points_segment = max(int(segment_distance / distance_between_points), 1)
-        
-        # Linearly interpolate in UTM coordinates
-        xs = np.linspace(x1, x2, num_points_segment + 2)  # +2 because endpoints are included
-        ys = np.linspace(y1, y2, num_points_segment + 2)
-        
-        # Convert interpolated points back to lat-lon and add to the output, excluding the first point to avoid duplication
-        for j in range(1, len(xs) - 1):
-            lon, lat = transform(proj_utm, proj_latlon, xs[j], ys[j])
-            interpolated_path.append((lat, lon))
+        interpolated_path.extend(interpolate_segment(path[i], path[i+1], distance_between_points, utm_zone))
     
     interpolated_path.append(path[-1])
     return interpolated_path
 
 
+_projections = threading.local()
+
+
+def _utm_projections(utm_zone):
+    """Per-thread (Geod, UTM Proj, lat/lon Proj) for a UTM zone; pyproj objects are not shared across threads."""
+    cache = getattr(_projections, "zones", None)
+    if cache is None:
+        cache = _projections.zones = {}
+    if utm_zone not in cache:
+        cache[utm_zone] = (Geod(ellps='WGS84'), Proj(f'+proj=utm +zone={utm_zone} +ellps=WGS84'),
+                           Proj(proj='latlong', ellps='WGS84'))
+    return cache[utm_zone]
+
+
+def interpolate_segment(start, end, distance_between_points, utm_zone):
+    """
+    Points strictly between two (lat, lon) vertices, as interpolate_geopath_equidistant places them.
+
+    The result depends only on the two vertices, the spacing and the route's UTM zone, so a segment
+    shared by several routes can be interpolated once (see shared_segments.py).
+    """
+    geod, proj_utm, proj_latlon = _utm_projections(utm_zone)
+
+    # Convert current pair of points to UTM
+    x1, y1 = transform(proj_latlon, proj_utm, start[1], start[0])
+    x2, y2 = transform(proj_latlon, proj_utm, end[1], end[0])
+
+    # Calculate distance for the current segment to determine segment-specific interpolation
+    _, _, segment_distance = geod.inv(start[1], start[0], end[1], end[0])
+    num_points_segment = max(int(segment_distance / distance_between_points), 1)
+
+    # Linearly interpolate in UTM coordinates
+    xs = np.linspace(x1, x2, num_points_segment + 2)  # +2 because endpoints are included
+    ys = np.linspace(y1, y2, num_points_segment + 2)
+
+    # Convert interpolated points back to lat-lon, excluding both endpoints to avoid duplication
+    points = []
+    for j in range(1, len(xs) - 1):
+        lon, lat = transform(proj_utm, proj_latlon, xs[j], ys[j])
+        points.append((lat, lon))
+    return points
+
+
 def _sample_from_npz(raster_values, transform_tuple, shape_2d, point, scale=1.0):
     """Get raster value at (point.x, point.y). Match rasterio: use floor for (row,col) so .npz matches .tif."""
     from rasterio.transform import Affine
@@ -158,100 +263,190 @@ def _sample_from_npz(raster_values, transform_tuple, shape_2d, point, scale=1.0)
     return val / scale if scale != 1.0 else val
 
 
-def create_shapefiles_and_extract_raster_values(interpolated_routes, raster_path, output_dir):
-    """Load raster from .tif (rasterio) or .npz (numpy). raster_path can be path to .tif or .npz."""
-    t_total = time.perf_counter()
+_local = threading.local()
+
+
+def _open_dataset(raster_path):
+    """Per-thread rasterio handle for raster_path, reopened when the file changes on disk."""
+    handles = getattr(_local, "datasets", None)
+    if handles is None:
+        handles = _local.datasets = {}
+    st_ = os.stat(raster_path)
+    stamp = (st_.st_size, st_.st_mtime_ns)
+    cached = handles.get(raster_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    src = rasterio.open(raster_path)
+    handles[raster_path] = (stamp, src)
+    return src
+
+
+def _read_route_window(src, xs, ys):
+    """
+    Read only the block-aligned window of band 1 covering the projected points.
+
+    :return: (window values, (row, col) of every point within the window). Points are located with
+        rowcol (floor, as src.index does) and clamped to the raster edge, like the .npz path.
+    """
+    rows, cols = rowcol(src.transform, xs, ys, op=np.floor)
+    rows = np.clip(np.asarray(rows, dtype=np.intp), 0, src.height - 1)
+    cols = np.clip(np.asarray(cols, dtype=np.intp), 0, src.width - 1)
+    # Grow the bounding box to whole internal blocks so each tile/strip is decoded once
+    block_h, block_w = src.block_shapes[0]
+    row0 = rows.min() // block_h * block_h
+    col0 = cols.min() // block_w * block_w
+    row1 = min(-(-(rows.max() + 1) // block_h) * block_h, src.height)
+    col1 = min(-(-(cols.max() + 1) // block_w) * block_w, src.width)
+    window = Window(col0, row0, col1 - col0, row1 - row0)
+    return src.read(1, window=window), (rows - row0, cols - col0)
+
+
+def create_shapefiles_and_extract_raster_values(interpolated_routes, raster_path, output_dir,
+                                                sample_mode="floor", corridor_m=None, registry=None, shared=None,
+                                                first_route=0):
+    """
+    Load raster from .tif (rasterio) or .npz (numpy). raster_path can be path to .tif or .npz.
+
+    A .tif is read only within the block-aligned bounding box of all route points, through a
+    per-thread dataset handle. sample_mode "floor" reads one cell per point; "bilinear" and
+    "corridor" (mean within corridor_m metres, see sampling.py) sample the process-wide resident
+    raster instead. With a raster_registry.RasterRegistry, raster_path is ignored, each point is
+    read from the preferred raster covering it and the "raster_idx" column records which.
+    A layer stack (*.stack.npz, see layer_stack.py) adds one column per extra layer (e.g. "shade").
+    With shared (a shared_segments.SharedSegments built from the same routes), only its unique
+    points are projected and sampled; each route's rows are gathered from them, and shared.values
+    is set to the UTCI of the unique points. Shapefiles are numbered from first_route + 1.
+    """
     os.makedirs(output_dir, exist_ok=True)
     shapefile_paths = {}
     gdfs = []
-    use_npz = raster_path.lower().endswith(".npz")
-
-    if use_npz:
-        t = time.perf_counter()
-        data = np.load(raster_path, allow_pickle=False)
-        raster_values = data["values"]
-        transform_tuple = tuple(data["transform"].tolist())
-        sh = data.get("shape", np.array(raster_values.shape))
-        shape_2d = (int(sh[0]), int(sh[1])) if sh.size >= 2 else raster_values.shape
-        # UTCI values only: stored as int16 * scale; divide by scale when sampling (lat/lon unchanged)
-        scale = float(data["scale"]) if "scale" in data else 1.0
-        _log_profile("npz_load", time.perf_counter() - t)
-    else:
-        t = time.perf_counter()
-        src = rasterio.open(raster_path)
-        _log_profile("raster_open", time.perf_counter() - t)
-        try:
-            t = time.perf_counter()
-            raster_values = src.read(1)
-            _log_profile("raster_read_full_band", time.perf_counter() - t)
-            transform_tuple = None
-            shape_2d = raster_values.shape
-        except Exception:
-            src.close()
-            raise
-
-    for i, route in enumerate(interpolated_routes):
-        t_route = time.perf_counter()
-
-        t = time.perf_counter()
-        points = [Point(lon, lat) for lat, lon in route]
-        gdf = gpd.GeoDataFrame(geometry=points, crs="EPSG:4326")
-        _log_profile(f"route_{i}_gdf_create", time.perf_counter() - t)
-
-        t = time.perf_counter()
-        gdf = gdf.to_crs(epsg=6343)
-        _log_profile(f"route_{i}_to_crs", time.perf_counter() - t)
-
-        t = time.perf_counter()
-        raster_values_list = []
-        if use_npz:
-            for point in gdf.geometry:
-                val = _sample_from_npz(raster_values, transform_tuple, shape_2d, point, scale)
-                raster_values_list.append(val)
+    use_stack = registry is None and is_stack(raster_path)
+    use_npz = raster_path is not None and raster_path.lower().endswith(".npz") and not use_stack
+    resident = None
+    stack = None
+
+    # Routes sampled as a whole, or one batch of the unique points of shared segments
+    batches = [shared.points] if shared is not None else interpolated_routes
+
+    with stage_timer("project"):
+        projected = []
+        for route in batches:
+            points = [Point(lon, lat) for lat, lon in route]
+            gdf = gpd.GeoDataFrame(geometry=points, crs="EPSG:4326")
+            projected.append(gdf.to_crs(epsg=6343))
+
+    with stage_timer("raster_load"):
+        if use_stack:
+            stack = open_stack(raster_path)  # memory-mapped, nothing read until sampling
+        if registry is not None:
+            pass  # rasters are loaded lazily per point batch
+        elif sample_mode != "floor":
+            resident = load_raster(raster_path)
+            if sample_mode == "corridor":
+                resident.summed_area()  # built once per raster version
+        elif use_stack:
+            pass
+        elif use_npz:
+            data = np.load(raster_path, allow_pickle=False)
+            raster_values = data["values"]
+            transform_tuple = tuple(data["transform"].tolist())
+            sh = data.get("shape", np.array(raster_values.shape))
+            shape_2d = (int(sh[0]), int(sh[1])) if sh.size >= 2 else raster_values.shape
+            # UTCI values only: stored as int16 * scale; divide by scale when sampling (lat/lon unchanged)
+            scale = float(data["scale"]) if "scale" in data else 1.0
         else:
-            for point in gdf.geometry:
-                row, col = src.index(point.x, point.y)
-                raster_values_list.append(raster_values[row, col])
-        _log_profile(f"route_{i}_sample_points(n={len(gdf)})", time.perf_counter() - t)
+            xs = np.concatenate([gdf.geometry.x.to_numpy() for gdf in projected])
+            ys = np.concatenate([gdf.geometry.y.to_numpy() for gdf in projected])
+            window_values, (rows, cols) = _read_route_window(_open_dataset(raster_path), xs, ys)
+            offsets = np.cumsum([0] + [len(gdf) for gdf in projected])
+
+    sampled = []
+    for i, gdf in enumerate(projected):
+        with stage_timer("sample"):
+            raster_values_list = []
+            layers = {}
+            if stack is not None:
+                # One gather for every layer at each point's cell
+                layers = stack.sample(gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy())
+            if registry is not None:
+                raster_values_list, gdf["raster_idx"] = registry.sample(batches[i], sample_mode, corridor_m)
+            elif resident is not None:
+                raster_values_list = sample_points(resident, gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy(),
+                                                   sample_mode, corridor_m)
+            elif stack is not None:
+                raster_values_list = layers["utci"]
+            elif use_npz:
+                for point in gdf.geometry:
+                    val = _sample_from_npz(raster_values, transform_tuple, shape_2d, point, scale)
+                    raster_values_list.append(val)
+            else:
+                span = slice(offsets[i], offsets[i + 1])
+                raster_values_list = window_values[rows[span], cols[span]]
 
-        gdf["raster_value"] = raster_values_list
-        gdfs.append(gdf)
+            gdf["raster_value"] = raster_values_list
+            for name, values in layers.items():
+                if name != "utci":
+                    gdf[name] = values
+        sampled.append(gdf)
 
-        t = time.perf_counter()
-        shapefile_name = f"route_{i+1}_with_raster_values.shp"
-        shapefile_path = os.path.join(output_dir, shapefile_name)
-        gdf.to_file(shapefile_path)
-        _log_profile(f"route_{i}_to_file_shp", time.perf_counter() - t)
+    if shared is not None:
+        shared.values = sampled[0]["raster_value"].to_numpy(dtype=np.float64)
+        sampled = [sampled[0].iloc[index].reset_index(drop=True) for index in shared.route_index]
 
-        shapefile_paths[i + 1] = shapefile_path
-        _log_profile(f"route_{i}(TOTAL)", time.perf_counter() - t_route)
+    for i, gdf in enumerate(sampled):
+        gdfs.append(gdf)
+
+        with stage_timer("write_output"):
+            shapefile_name = f"route_{first_route + i + 1}_with_raster_values.shp"
+            shapefile_path = os.path.join(output_dir, shapefile_name)
+            gdf.to_file(shapefile_path)
 
-    if not use_npz:
-        src.close()
+        shapefile_paths[first_route + i + 1] = shapefile_path
 
-    _log_profile("create_shapefiles_and_extract_raster_values(TOTAL_utils)", time.perf_counter() - t_total)
     return gdfs, shapefile_paths
 
 import requests
 
 def get_lat_lon_from_address(address, api_key):
     """Convert an address to latitude and longitude using Google Geocoding API."""
-    t0 = time.perf_counter()
-    base_url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {"address": address, "key": api_key}
-    t = time.perf_counter()
-    response = requests.get(base_url, params=params)
-    _log_profile("geocode_http_request", time.perf_counter() - t)
-    if response.status_code == 200:
-        data = response.json()
-        if data['status'] == 'OK':
-            location = data['results'][0]['geometry']['location']
-            _log_profile("get_lat_lon_from_address(TOTAL)", time.perf_counter() - t0)
-            return (location['lat'], location['lng'])
-        else:
-            return None, None
-    else:
-        return None, None
+    return get_lat_lon_from_addresses([address], api_key)[0]
+
+
+def get_lat_lon_from_addresses(addresses, api_key):
+    """
+    (lat, lon) for each address: from the gazetteer, else from Google (cached geocodes for the
+    whole batch are read in one round-trip), learning Google's answers into the gazetteer.
+    """
+    locations = [gazetteer.geocode(address) for address in addresses]
+    missing = [i for i, location in enumerate(locations) if location is None]
+    keys = {i: normalize_place(addresses[i]) for i in missing}
+    cached = geocode_api.lookup(list(keys.values())) if missing else {}
+    for i in missing:
+        address = addresses[i]
+        location = geocode_api.call(keys[i], lambda address=address: _geocode(address, api_key), cached[keys[i]])
+        if location and location[2] and GAZETTEER_LEARN:
+            gazetteer.learn(location[2], location[0], location[1])
+        locations[i] = location[:2] if location else (None, None)
+    return locations
+
+
+def _geocode(address, api_key):
+    geocode_limiter.acquire(GOOGLE_RATE_MAX_WAIT)
+    with stage_timer("geocode"):
+        base_url = f"{GOOGLE_MAPS_API_BASE}/maps/api/geocode/json"
+        params = {"address": address, "key": api_key}
+        data = _google_get(base_url, params)
+    if data['status'] == 'OK':
+        try:
+            result = data['results'][0]
+            location = result['geometry']['location']
+            return (location['lat'], location['lng'], result.get('formatted_address'))
+        except (KeyError, IndexError, TypeError) as e:
+            raise UpstreamError(f"malformed geocode response: {e}")
+    # No match is an answer, not a failure; None is not remembered for stale fallback
+    return None
 
 def set_background_gradient():
     """